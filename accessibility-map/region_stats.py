@@ -0,0 +1,40 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+
+def count_points_in_regions(regions, points, attribute=None, value=None, total_column='stops', match_column='accessibility'):
+    """
+    Count the points that fall in each region with a single spatial join.
+
+    The join is backed by the STRtree index of geopandas, so the cost is roughly
+    O((regions + points) log n) instead of one full scan of the points per region.
+
+    Args:
+        regions (GeoDataFrame): polygon layer (IRIS, arrondissements, ...)
+        points (GeoDataFrame): point layer, e.g. data/stops.geojson
+        attribute (str): optional column of points to filter on, e.g. 'wheelchair_boarding'
+        value: the attribute value to count, e.g. 'available'
+        total_column (str): name of the output column with the total number of points
+        match_column (str): name of the output column with the number of points where attribute == value
+
+    Returns:
+        DataFrame indexed like regions, with integer counts (0 for regions without points)
+    """
+    columns = ['geometry'] if attribute is None else [attribute, 'geometry']
+    points = points[columns].to_crs(regions.crs)
+
+    # join on region positions, whatever the index of regions is named or holds
+    positions = regions[['geometry']].reset_index(drop=True)
+    positions['region_position'] = np.arange(len(positions))
+    joined = gpd.sjoin(points, positions, how='inner', predicate='within')
+    region_of_point = joined['region_position'].to_numpy()
+
+    counts = pd.DataFrame(index=regions.index)
+    counts[total_column] = np.bincount(region_of_point, minlength=len(regions))
+
+    if attribute is not None:
+        matches = region_of_point[(joined[attribute] == value).to_numpy()]
+        counts[match_column] = np.bincount(matches, minlength=len(regions))
+
+    return counts
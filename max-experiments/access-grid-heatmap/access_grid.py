@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+from branca.colormap import LinearColormap
+from folium_layers import COMPACT_DECIMALS, geojson_layer, polygon_collection
+from stop_index import project, unproject
+
+SHAPES = ('square', 'hex')
+
+# green (close to a stop) to red (far from any stop)
+ACCESS_COLORS = ['#1a9850', '#fee08b', '#d73027']
+
+
+def cell_index(x, y, cell_size, shape='square'):
+    """
+    Integer cell coordinates (i, j) of metric points x / y (Lambert-93 meters).
+
+    Squares are `cell_size` meters wide, aligned on multiples of cell_size.
+    Hexes are pointy-top, `cell_size` meters between opposite sides (so between
+    neighbouring centers), indexed by axial coordinates (q, r).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if shape == 'square':
+        return np.floor(x / cell_size).astype(np.int64), np.floor(y / cell_size).astype(np.int64)
+    if shape != 'hex':
+        raise ValueError(f"shape must be one of {SHAPES}")
+
+    # fractional axial coordinates, then cube rounding to the nearest hex center
+    radius = cell_size / np.sqrt(3)
+    q = (np.sqrt(3) / 3 * x - y / 3) / radius
+    r = (2 / 3 * y) / radius
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def cell_rings(i, j, cell_size, shape='square'):
+    """Closed outline of every cell as a (n_cells, n_vertices, 2) array of metric x / y."""
+    i = np.asarray(i, dtype=np.float64)[:, None]
+    j = np.asarray(j, dtype=np.float64)[:, None]
+    if shape == 'square':
+        dx = np.array([0, 1, 1, 0, 0]) * cell_size
+        dy = np.array([0, 0, 1, 1, 0]) * cell_size
+        return np.stack([i * cell_size + dx, j * cell_size + dy], axis=-1)
+    if shape != 'hex':
+        raise ValueError(f"shape must be one of {SHAPES}")
+
+    radius = cell_size / np.sqrt(3)
+    center_x = radius * np.sqrt(3) * (i + j / 2)
+    center_y = radius * 1.5 * j
+    angles = np.radians(30 + 60 * np.arange(7))
+    return np.stack([center_x + radius * np.cos(angles), center_y + radius * np.sin(angles)], axis=-1)
+
+
+def access_grid(lat, lon, distance, cell_size=250, shape='square'):
+    """
+    Per-cell statistics of the building-to-nearest-stop distances.
+
+    Buildings are binned into a metric grid (see cell_index) and aggregated in
+    one groupby, so the result has one row per occupied cell, whatever the
+    number of buildings.
+
+    Returns:
+        DataFrame with columns i, j, buildings (count), mean, max and p90 (meters)
+    """
+    xy = project(lat, lon)
+    i, j = cell_index(xy[:, 0], xy[:, 1], cell_size, shape)
+    df = pd.DataFrame({'i': i, 'j': j, 'distance': np.asarray(distance, dtype=np.float64)})
+    df = df[np.isfinite(df['distance'])]
+
+    grouped = df.groupby(['i', 'j'], sort=False)
+    stats = grouped['distance'].agg(buildings='count', mean='mean', max='max')
+    stats['p90'] = grouped['distance'].quantile(0.9)
+    return stats.reset_index()
+
+
+def grid_collection(stats, cell_size, shape='square', value='p90', vmax=None, decimals=None):
+    """
+    GeoJSON FeatureCollection with one polygon per row of access_grid(), colored
+    by the `value` column. Every feature carries its statistics, a `style` object
+    and a `label` (tooltip HTML).
+
+    Returns:
+        (FeatureCollection, branca colormap for the map's legend)
+    """
+    rings = cell_rings(stats['i'], stats['j'], cell_size, shape)
+    n_cells, n_vertices, _ = rings.shape
+    lat, lon = unproject(rings[:, :, 0].ravel(), rings[:, :, 1].ravel())
+    offsets = np.arange(n_cells + 1) * n_vertices
+
+    values = stats[value].to_numpy()
+    if vmax is None:
+        vmax = float(np.max(values)) if n_cells else 1.0
+    colormap = LinearColormap(ACCESS_COLORS, vmin=0, vmax=vmax, caption=f'{value} distance to the nearest stop (m)')
+    colors = [colormap.rgb_hex_str(v) for v in np.clip(values, 0, vmax)]
+
+    labels = (stats['buildings'].astype(str) + ' buildings<br>mean ' + stats['mean'].round().astype(int).astype(str)
+              + ' m<br>p90 ' + stats['p90'].round().astype(int).astype(str)
+              + ' m<br>max ' + stats['max'].round().astype(int).astype(str) + ' m')
+    properties = {
+        'buildings': stats['buildings'].to_numpy().tolist(),
+        'mean': stats['mean'].round(1).tolist(),
+        'p90': stats['p90'].round(1).tolist(),
+        'max': stats['max'].round(1).tolist(),
+        'label': labels.tolist(),
+        'style': [{'fillColor': color} for color in colors],
+    }
+    return polygon_collection(lat, lon, offsets, properties=properties, decimals=decimals), colormap
+
+
+def grid_layer(lat, lon, distance, cell_size=250, shape='square', value='p90', vmax=None, sidecar=None, **kwargs):
+    """
+    Access grid of buildings as one styled GeoJsonLayer, plus its colormap.
+
+    The layer's size follows the number of cells rather than the number of
+    buildings. Remaining keyword arguments go to GeoJsonLayer (name, show, ...).
+    """
+    stats = access_grid(lat, lon, distance, cell_size, shape)
+    # cells are hundreds of meters wide, ~1 m vertex precision is plenty even inline
+    collection, colormap = grid_collection(stats, cell_size, shape, value, vmax,
+                                           decimals=sidecar.decimals if sidecar else COMPACT_DECIMALS)
+    layer = geojson_layer(collection, sidecar=sidecar, style={'stroke': False, 'fillOpacity': 0.6},
+                          style_property='style', tooltip='label', **kwargs)
+    return layer, colormap
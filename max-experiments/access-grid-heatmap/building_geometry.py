@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+from overpass_stream import resolve_way_nodes
+from stop_index import project, unproject
+
+
+def building_centroids(buildings):
+    """
+    One point per building: polygon centroid and footprint area of every way.
+
+    Works directly on the CSR arrays from overpass_stream.parse_stream(), with the
+    shoelace formula evaluated for all ways at once in Lambert-93 meters.
+    Ways that reference nodes missing from the response are dropped, and
+    degenerate ways (lines, zero area) fall back to the mean of their vertices.
+
+    Returns:
+        DataFrame with columns way_id, lat, lon, area (square meters) and building (OSM tag)
+    """
+    way_offsets = buildings['way_offsets']
+    lengths = np.diff(way_offsets)
+    n_ways = len(lengths)
+
+    node_index = resolve_way_nodes(buildings)
+    way_of_node = np.repeat(np.arange(n_ways), lengths)
+
+    # drop empty ways and ways with unresolved nodes
+    complete = (np.bincount(way_of_node, weights=node_index < 0, minlength=n_ways) == 0) & (lengths > 0)
+    keep_node = complete[way_of_node]
+    node_index = node_index[keep_node]
+    way_of_node = way_of_node[keep_node]
+    lengths = lengths[complete]
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    ends = starts + lengths - 1
+    way_of_node = np.repeat(np.arange(len(lengths)), lengths)
+    n_ways = len(lengths)
+
+    xy = project(buildings['node_lat'][node_index], buildings['node_lon'][node_index])
+
+    # shift every ring to its first vertex to keep the cross products well conditioned
+    origin = xy[starts]
+    x = xy[:, 0] - origin[way_of_node, 0]
+    y = xy[:, 1] - origin[way_of_node, 1]
+
+    # consecutive vertex pairs inside each way, plus the closing edge (zero for closed rings)
+    same_way = way_of_node[:-1] == way_of_node[1:]
+    x0 = np.concatenate([x[:-1][same_way], x[ends]])
+    y0 = np.concatenate([y[:-1][same_way], y[ends]])
+    x1 = np.concatenate([x[1:][same_way], x[starts]])
+    y1 = np.concatenate([y[1:][same_way], y[starts]])
+    edge_way = np.concatenate([way_of_node[:-1][same_way], np.arange(n_ways)])
+
+    cross = x0 * y1 - x1 * y0
+    signed_area = 0.5 * np.bincount(edge_way, weights=cross, minlength=n_ways)
+    cx = np.bincount(edge_way, weights=(x0 + x1) * cross, minlength=n_ways)
+    cy = np.bincount(edge_way, weights=(y0 + y1) * cross, minlength=n_ways)
+
+    # vertex mean for degenerate ways (skip the repeated closing node of a ring)
+    closed = (x[ends] == 0) & (y[ends] == 0) & (lengths > 1)
+    vertex_weight = np.ones(len(x))
+    vertex_weight[ends[closed]] = 0
+    vertex_count = np.maximum(np.bincount(way_of_node, weights=vertex_weight, minlength=n_ways), 1)
+    mean_x = np.bincount(way_of_node, weights=x * vertex_weight, minlength=n_ways) / vertex_count
+    mean_y = np.bincount(way_of_node, weights=y * vertex_weight, minlength=n_ways) / vertex_count
+
+    degenerate = np.abs(signed_area) < 1e-9
+    safe_area = np.where(degenerate, 1, signed_area)
+    centroid_x = np.where(degenerate, mean_x, cx / (6 * safe_area)) + origin[:, 0]
+    centroid_y = np.where(degenerate, mean_y, cy / (6 * safe_area)) + origin[:, 1]
+
+    lat, lon = unproject(centroid_x, centroid_y)
+    return pd.DataFrame({
+        'way_id': buildings['way_ids'][complete],
+        'lat': lat,
+        'lon': lon,
+        'area': np.abs(signed_area),
+        'building': buildings['way_building'][complete],
+    })
@@ -1,15 +1,14 @@
-import requests
-import json
-import geopandas as gpd
-from shapely.geometry import shape
 import folium
-from tqdm import tqdm
+import numpy as np
+from building_geometry import building_centroids
+from folium_layers import Sidecar, geojson_layer, heat_layer, polygon_collection
+from overpass_cache import fetch_buildings
+from overpass_stream import resolve_way_nodes
 
 # Bounding box for Lyon, France
 bbox = (45.55706959, 4.6917603, 45.93918271, 5.06029048)
 
 # Overpass API query for Lyon, France
-overpass_url = "http://overpass-api.de/api/interpreter"
 overpass_query = f"""
 [out:json];
 (
@@ -20,9 +19,8 @@ out body;
 out skel qt;
 """
 
-# Fetch data from Overpass API
-response = requests.get(overpass_url, params={'data': overpass_query})
-data = response.json()
+# Fetch data from Overpass API (or the local cache, set OVERPASS_OFFLINE=1 to never hit the API)
+data = fetch_buildings(overpass_query, bbox)
 
 
 # Create a Folium map centered on Lyon
@@ -31,30 +29,37 @@ map_center = [45.75, 4.85]  # Coordinates for Lyon
 mymap = folium.Map(location=map_center, zoom_start=12)
 
 # Parse the data to extract building geometries
-elements = data['elements']
-node_dict = {element['id']: (element['lat'], element['lon']) for element in data['elements'] if element['type'] == 'node'}
-
-done = 0
-tot = len(elements)
-
-for element in data['elements']:
-    
-    done += 1
-    
-    if done % 1000 == 0:
-        print(f"{round(done/tot, 3) * 100}% done..")
-    
-    if element['type'] == 'way' and 'nodes' in element:
-        coords = [node_dict[node_id] for node_id in element['nodes']]
-        center = folium.Polygon(locations=coords).get_bounds()
-        building_center = [(center[0][0] + center[1][0]) / 2, (center[0][1] + center[1][1]) / 2]
-        
-        color = 'red'
-        
-        folium.Polygon(locations=coords, color=color, fill=True, fill_opacity=0.5).add_to(mymap)
+# row of each way node in the node arrays (id -> index via binary search, no dict)
+way_node_index = resolve_way_nodes(data)
+way_offsets = data['way_offsets']
+way_lengths = np.diff(way_offsets)
 
+# drop empty ways and ways referencing a node missing from the response
+missing = np.zeros(len(way_lengths), dtype=bool)
+np.logical_or.at(missing, np.repeat(np.arange(len(way_lengths)), way_lengths), way_node_index < 0)
+keep = (way_lengths > 0) & ~missing
+node_index = way_node_index[np.repeat(keep, way_lengths)]
+offsets = np.concatenate([[0], np.cumsum(way_lengths[keep])])
+print(f"{keep.sum()}/{len(keep)} buildings with complete geometry")
+
+# all buildings as one GeoJSON layer, with COMPACT the polygons go to out/lyon_buildings_data/
+COMPACT = True
+html_path = 'out/lyon_buildings.html'
+sidecar = Sidecar(html_path) if COMPACT else None
+buildings = polygon_collection(data['node_lat'][node_index], data['node_lon'][node_index], offsets,
+                               decimals=sidecar.decimals if sidecar else None)
+geojson_layer(buildings, sidecar=sidecar, style={'color': 'red', 'fill': True, 'fillOpacity': 0.5},
+              name='Buildings').add_to(mymap)
+
+# One centroid per building, as a heat layer of built-up footprint (weight 1 = a median building)
+building_centers = building_centroids(data)
+print(f"{len(building_centers)} buildings, {round(building_centers['area'].sum() / 1e6, 2)} km2 of footprint")
+footprint = building_centers['area'] / building_centers['area'].median()
+heat_layer(building_centers['lat'], building_centers['lon'], footprint, sidecar=sidecar,
+           name='Building footprint').add_to(mymap)
+folium.LayerControl().add_to(mymap)
 
 # Save map to HTML file
-mymap.save('out/lyon_buildings.html')
+mymap.save(html_path)
 
 print("Map saved to lyon_buildings.html")
@@ -1,15 +1,17 @@
 import geopandas as gpd
 import folium
-from folium.plugins import HeatMap
+from access_grid import grid_layer
+from folium_layers import Sidecar, geojson_layer, heat_layer, point_collection
 import os
-import requests
 import json
 import numpy as np
 import pandas as pd
-import math
-from scipy.spatial import KDTree
+from building_geometry import building_centroids
+from overpass_cache import fetch_buildings
+from stop_index import StopIndex
+from walking_access import GRAPHML_FILENAME, WalkingAccess
 
-def generate_building_heatmap(percentile_distances=99, residential=True, show_arrondissements=True, show_metro_lines=False, show_bus_lines=False, show_tram_lines=False, show_funicular_lines=False, export_csv=False, show_stops=False, filename='lyon_stops_distance_heatmap_no_markers.html', show_iris=False):
+def generate_building_heatmap(percentile_distances=99, residential=True, show_arrondissements=True, show_metro_lines=False, show_bus_lines=False, show_tram_lines=False, show_funicular_lines=False, export_csv=False, show_stops=False, filename='lyon_stops_distance_heatmap_no_markers.html', show_iris=False, offline=None, weight_by_area=False, compact=False, grid=None, cell_size=250, walking=False, graphml=GRAPHML_FILENAME):
     # Load GeoJSON data
     if show_arrondissements:
         print("Using Arrondissements Regions")
@@ -27,14 +29,10 @@ def generate_building_heatmap(percentile_distances=99, residential=True, show_ar
     # Perform a spatial join to filter stops within arrondissements
     stops_within_arrondissements = gpd.sjoin(stops, arrondissements, how='inner', op='within')
 
-    # Extract coordinates for the heatmap
-    heatmap_data = [[point.y, point.x] for point in stops_within_arrondissements.geometry]
-
     # Define the bounding box for the Lyon Metropolis
     minx, miny, maxx, maxy = arrondissements.total_bounds
     
     # Overpass API query for Lyon, France
-    overpass_url = "http://overpass-api.de/api/interpreter"
     if residential:
         overpass_query = f"""
         [out:json];
@@ -65,85 +63,56 @@ def generate_building_heatmap(percentile_distances=99, residential=True, show_ar
         """
         
 
-    # Fetch data from Overpass API
-    response = requests.get(overpass_url, params={'data': overpass_query})
-    data = response.json()
-
+    # Fetch data from Overpass API (or the local cache)
+    buildings = fetch_buildings(overpass_query, (miny, minx, maxy, maxx), offline=offline)
 
-    buildings_coords = []
-
-    for element in data['elements']:
-        if element['type'] == "node":
-            buildings_coords.append([element['lat'], element['lon'], -1, ''])
+    # One point per building (polygon centroid), with its footprint area
+    buildings_coords = building_centroids(buildings)
 
     # Convert buildings_coords to a GeoDataFrame
     buildings_gdf = gpd.GeoDataFrame(
-        buildings_coords,
-        columns=['lat', 'lon', 'distance', 'nearest_station'],
-        geometry=gpd.points_from_xy([coord[1] for coord in buildings_coords], [coord[0] for coord in buildings_coords]),
+        buildings_coords[['lat', 'lon', 'area']],
+        geometry=gpd.points_from_xy(buildings_coords['lon'], buildings_coords['lat']),
         crs=arrondissements.crs
     )
 
     # Perform a spatial join to filter buildings within arrondissements
     buildings_within_arrondissements = gpd.sjoin(buildings_gdf, arrondissements, how='inner', op='within')
 
-    # Get list of station coords and names
-    station_coords = []
-    station_names = []
-    stops_json = json.loads(open('data/stops.geojson', 'r').read())
-
-    for stop in stops_json['features']:
-        station_coords.append(stop['geometry']['coordinates'])
-        station_names.append(stop['properties']['name'])
-
-    print(f"Got {len(buildings_coords)} buildings and {len(station_coords)} stops")
-
-    def haversine(lat1, lon1, lat2, lon2):
-        R = 6371000  # radius of Earth in meters
-        phi1 = math.radians(lat1)
-        phi2 = math.radians(lat2)
-        delta_phi = math.radians(lat2 - lat1)
-        delta_lambda = math.radians(lon2 - lon1)
-        a = math.sin(delta_phi / 2.0) ** 2 + \
-            math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2.0) ** 2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        meters = R * c  # output distance in meters
-        return meters
-
-    def compute_closest_stations(buildings_coords, station_coords, station_names):
-        # Convert station coordinates to a numpy array for KDTree
-        station_coords_np = np.array(station_coords)
-        
-        # Create KDTree for station coordinates
-        station_tree = KDTree(station_coords_np)
-        i = 0
-        for building in buildings_coords:
-            i+=1
-            if i % 50000 == 0:
-                print(f"{round(i/len(buildings_coords)*100)}% of distances computed..")
-            building_lat, building_lon = building[:2]
-            distance, index = station_tree.query([building_lon, building_lat])
-            closest_station = station_coords_np[index]
-            distance = haversine(building_lat, building_lon, closest_station[1], closest_station[0])
-            building[2] = distance
-            building[3] = station_names[index]
-        
-        return buildings_coords
-
-    buildings_within_arrondissements = compute_closest_stations(
-        buildings_within_arrondissements[['lat', 'lon', 'distance', 'nearest_station']].values.tolist(),
-        station_coords,
-        station_names
-    )
+    # Metric stop index, rebuilt only when data/stops.geojson changes
+    stop_index = StopIndex.cached('data/stops.geojson', 'out/stop_index.pkl')
+
+    print(f"Got {len(buildings_coords)} buildings and {len(stop_index)} stops")
+
+    # One bulk nearest-station query for every building
+    distances, indices = stop_index.nearest(buildings_within_arrondissements[['lat', 'lon']].to_numpy())
+    if walking:
+        # walking distance over the street graph (saved GraphML, see walking_access.download_graphml),
+        # straight-line distance kept for buildings off the graph (further than MAX_SNAP_DISTANCE
+        # from any street, e.g. outside the downloaded commune) or whose nearest street reaches no stop
+        access = WalkingAccess.cached(stop_index.coords[:, 1], stop_index.coords[:, 0], graphml, 'out/walking_access.npz')
+        walking_distances, walking_indices = access.query(buildings_within_arrondissements['lat'].to_numpy(),
+                                                          buildings_within_arrondissements['lon'].to_numpy())
+        reachable = np.isfinite(walking_distances)
+        distances = np.where(reachable, walking_distances, distances)
+        indices = np.where(reachable, walking_indices, indices)
+    buildings_within_arrondissements = pd.DataFrame({
+        'lat': buildings_within_arrondissements['lat'].to_numpy(),
+        'lon': buildings_within_arrondissements['lon'].to_numpy(),
+        'distance': distances,
+        'nearest_station': stop_index.names[indices],
+        'area': buildings_within_arrondissements['area'].to_numpy()
+    })
 
     # Filter out the lowest N% of distance points
-    distances = [building[2] for building in buildings_within_arrondissements]
-    threshold = np.percentile(distances, percentile_distances)
+    threshold = np.percentile(buildings_within_arrondissements['distance'], percentile_distances)
     print(f"Showing buildings over {threshold} meters from closest station.")
-    filtered_buildings_coords = [building for building in buildings_within_arrondissements if building[2] > threshold]
+    filtered_buildings_coords = buildings_within_arrondissements[buildings_within_arrondissements['distance'] > threshold]
     print(len(filtered_buildings_coords))
     # Create the base map centered on Lyon
     m = folium.Map(location=[(miny + maxy) / 2, (minx + maxx) / 2], zoom_start=11)
+    # compact: rounded coordinates in out/<filename>_data/ instead of inlined in the HTML
+    sidecar = Sidecar(f'out/{filename}') if compact else None
 
 
 
@@ -205,18 +174,27 @@ def generate_building_heatmap(percentile_distances=99, residential=True, show_ar
             tooltip=folium.GeoJsonTooltip(fields=[], aliases=[])
         ).add_to(m)
 
-    # Add the filtered heatmap to the map
-    HeatMap([[building[0], building[1], building[2]] for building in filtered_buildings_coords]).add_to(m)
+    if grid is not None:
+        # grid='square' or 'hex': p90 distance per cell_size cell over all buildings,
+        # the color scale saturates at the percentile threshold
+        layer, colormap = grid_layer(buildings_within_arrondissements['lat'], buildings_within_arrondissements['lon'],
+                                     buildings_within_arrondissements['distance'], cell_size=cell_size, shape=grid,
+                                     vmax=threshold, sidecar=sidecar)
+        layer.add_to(m)
+        colormap.add_to(m)
+    else:
+        # Add the filtered heatmap to the map
+        heat_weights = filtered_buildings_coords['distance']
+        if weight_by_area:
+            # bigger footprints (more residents / floor space) count for more
+            heat_weights = heat_weights * filtered_buildings_coords['area'] / filtered_buildings_coords['area'].median()
+        heat_layer(filtered_buildings_coords['lat'], filtered_buildings_coords['lon'], heat_weights, sidecar=sidecar).add_to(m)
 
     if show_stops:
         stops_within_arrondissements = gpd.sjoin(stops, arrondissements, how='inner', op='within')
-        for idx, row in stops_within_arrondissements.iterrows():
-            folium.RegularPolygonMarker(
-                location=[row.geometry.y, row.geometry.x],
-                color='purple',
-                num_sides=3,
-                radius=2
-            ).add_to(m)
+        stop_points = point_collection(stops_within_arrondissements.geometry.y, stops_within_arrondissements.geometry.x,
+                                       decimals=sidecar.decimals if sidecar else None)
+        geojson_layer(stop_points, sidecar=sidecar, point_style={'color': 'purple', 'radius': 2}).add_to(m)
 
     # Save the map
     m.save(f'out/{filename}')
@@ -225,8 +203,7 @@ def generate_building_heatmap(percentile_distances=99, residential=True, show_ar
 
 
     if export_csv:
-        # Create a DataFrame from the buildings_within_arrondissements list
-        buildings_df = pd.DataFrame(buildings_within_arrondissements, columns=['lat', 'long', 'distance', 'nearest_station'])
+        buildings_df = buildings_within_arrondissements.rename(columns={'lon': 'long'})
 
         # Save to CSV
         buildings_df.to_csv('out/building_distances_greater_lyon_region_all_buildings.csv', index=False)
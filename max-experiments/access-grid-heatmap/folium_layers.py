@@ -0,0 +1,248 @@
+import json
+import os
+import numpy as np
+from folium.map import Layer
+from folium.plugins import FastMarkerCluster, HeatMap
+from folium.template import Template
+
+# 5 decimals of a degree is ~1 m, plenty for a city map
+COMPACT_DECIMALS = 5
+
+# FastMarkerCluster callback for rows of [lat, lon] or [lat, lon, tooltip html]
+MARKER_CALLBACK = """function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    if (row.length > 2) {
+        marker.bindTooltip(row[2]);
+    }
+    return marker;
+}"""
+
+
+class Sidecar:
+    """
+    Compact output mode: layer data goes to JSON files next to the map's HTML
+    (in <map name>_data/) and is fetched by the browser, instead of being inlined.
+
+    Coordinates are rounded to `decimals` places. Browsers refuse fetch() on
+    file:// pages, so open the map through a web server (python -m http.server,
+    GitHub Pages, ...).
+    """
+
+    def __init__(self, html_path, decimals=COMPACT_DECIMALS):
+        self.directory = os.path.splitext(html_path)[0] + '_data'
+        self.decimals = decimals
+        self.count = 0
+
+    def write(self, name, data):
+        """Write `data` as minified JSON and return its URL relative to the HTML file."""
+        os.makedirs(self.directory, exist_ok=True)
+        filename = f'{self.count}_{name}.json'
+        self.count += 1
+        with open(os.path.join(self.directory, filename), 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        return f'{os.path.basename(self.directory)}/{filename}'
+
+
+class ArrayHeatMap(HeatMap):
+    """HeatMap whose points are either inlined as one array or fetched from a sidecar URL."""
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.heatLayer(
+                {{ this.data|tojson }},
+                {{ this.options|tojavascript }}
+            );
+            {%- if this.url %}
+            fetch({{ this.url|tojson }})
+                .then(function (response) { return response.json(); })
+                .then(function (data) { {{ this.get_name() }}.setLatLngs(data); });
+            {%- endif %}
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, data=None, url=None, **kwargs):
+        super().__init__([], **kwargs)
+        self._name = 'HeatMap'
+        self.data = data if data is not None else []
+        self.url = url
+
+
+class ArrayMarkerCluster(FastMarkerCluster):
+    """FastMarkerCluster whose rows are either inlined as one array or fetched from a sidecar URL."""
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                {{ this.callback }}
+
+                var cluster = L.markerClusterGroup({{ this.options|tojavascript }});
+                var addRows = function (data) {
+                    cluster.addLayers(data.map(callback));
+                };
+                {%- if this.url %}
+                fetch({{ this.url|tojson }})
+                    .then(function (response) { return response.json(); })
+                    .then(addRows);
+                {%- else %}
+                addRows({{ this.data|tojson }});
+                {%- endif %}
+
+                cluster.addTo({{ this._parent.get_name() }});
+                return cluster;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, data=None, url=None, callback=MARKER_CALLBACK, **kwargs):
+        super().__init__([], callback=callback, **kwargs)
+        self._name = 'FastMarkerCluster'
+        self.data = data if data is not None else []
+        self.url = url
+
+
+class GeoJsonLayer(Layer):
+    """
+    Lightweight GeoJSON layer with one style for every feature.
+
+    Unlike folium.GeoJson nothing is computed per feature in Python, and points
+    are drawn as circle markers with `point_style`. With `style_property` the
+    style object stored in that property of each feature is applied on top.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.geoJson(null, {
+                {%- if this.style_property %}
+                style: function (feature) {
+                    return Object.assign({}, {{ this.style|tojson }}, feature.properties[{{ this.style_property|tojson }}]);
+                },
+                {%- else %}
+                style: {{ this.style|tojson }},
+                {%- endif %}
+                pointToLayer: function (feature, latlng) {
+                    return L.circleMarker(latlng, {{ this.point_style|tojson }});
+                },
+                {%- if this.tooltip %}
+                onEachFeature: function (feature, layer) {
+                    layer.bindTooltip(String(feature.properties[{{ this.tooltip|tojson }}]));
+                },
+                {%- endif %}
+            });
+            {%- if this.url %}
+            fetch({{ this.url|tojson }})
+                .then(function (response) { return response.json(); })
+                .then(function (data) { {{ this.get_name() }}.addData(data); });
+            {%- else %}
+            {{ this.get_name() }}.addData({{ this.data|tojson }});
+            {%- endif %}
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, data=None, url=None, style=None, point_style=None, tooltip=None, style_property=None, name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'GeoJsonLayer'
+        self.data = data
+        self.url = url
+        self.style = style or {}
+        self.point_style = point_style or {'radius': 3}
+        self.tooltip = tooltip
+        self.style_property = style_property
+
+
+def _points(lat, lon, extra=(), decimals=None):
+    """Stack coordinate arrays (plus extra numeric columns) into an (N, k) array without NaN rows."""
+    data = np.column_stack([np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64),
+                            *[np.asarray(column, dtype=np.float64) for column in extra]])
+    keep = ~np.isnan(data).any(axis=1)
+    data = data[keep]
+    if decimals is not None:
+        data[:, :2] = np.round(data[:, :2], decimals)
+    return data, keep
+
+
+def heat_layer(lat, lon, weight=None, sidecar=None, decimals=None, **kwargs):
+    """
+    HeatMap layer built from coordinate (and optional weight) arrays in one go.
+
+    With a Sidecar the points are written to a JSON file and fetched by the page.
+    Remaining keyword arguments are HeatMap options (radius, blur, gradient, ...).
+    """
+    if sidecar is not None:
+        decimals = sidecar.decimals
+    data, _ = _points(lat, lon, [] if weight is None else [weight], decimals)
+    if sidecar is not None:
+        return ArrayHeatMap(url=sidecar.write('heat', data.tolist()), **kwargs)
+    return ArrayHeatMap(data=data.tolist(), **kwargs)
+
+
+def marker_layer(lat, lon, tooltips=None, sidecar=None, decimals=None, **kwargs):
+    """
+    Clustered markers for coordinate arrays, created in the browser (FastMarkerCluster)
+    instead of one folium.Marker per point. `tooltips` is an optional sequence of
+    HTML strings, one per point.
+    """
+    if sidecar is not None:
+        decimals = sidecar.decimals
+    data, keep = _points(lat, lon, decimals=decimals)
+    rows = data.tolist()
+    if tooltips is not None:
+        tooltips = np.asarray(tooltips, dtype=object)[keep].tolist()
+        rows = [row + [tooltip] for row, tooltip in zip(rows, tooltips)]
+    if sidecar is not None:
+        return ArrayMarkerCluster(url=sidecar.write('markers', rows), **kwargs)
+    return ArrayMarkerCluster(data=rows, **kwargs)
+
+
+def _shape_collection(geometry_type, lat, lon, offsets, properties, decimals):
+    coords = np.column_stack([np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)])
+    if decimals is not None:
+        coords = np.round(coords, decimals)
+    shapes = np.split(coords, np.asarray(offsets)[1:-1])
+    columns = {name: np.asarray(values, dtype=object).tolist() for name, values in (properties or {}).items()}
+    return {
+        'type': 'FeatureCollection',
+        'features': [{'type': 'Feature',
+                      'properties': {name: values[i] for name, values in columns.items()},
+                      'geometry': {'type': geometry_type,
+                                   'coordinates': [shape.tolist()] if geometry_type == 'Polygon' else shape.tolist()}}
+                     for i, shape in enumerate(shapes)],
+    }
+
+
+def polygon_collection(lat, lon, offsets, properties=None, decimals=None):
+    """
+    GeoJSON FeatureCollection of polygons stored CSR-style: polygon i is made of
+    the vertices offsets[i]:offsets[i + 1] of the lat / lon arrays. `properties`
+    are optional per-polygon columns ({name: sequence}).
+    """
+    return _shape_collection('Polygon', lat, lon, offsets, properties, decimals)
+
+
+def line_collection(lat, lon, offsets, properties=None, decimals=None):
+    """GeoJSON FeatureCollection of lines stored CSR-style, like polygon_collection()."""
+    return _shape_collection('LineString', lat, lon, offsets, properties, decimals)
+
+
+def point_collection(lat, lon, properties=None, decimals=None):
+    """GeoJSON FeatureCollection of points, with optional per-point property columns ({name: sequence})."""
+    data, keep = _points(lat, lon, decimals=decimals)
+    columns = {name: np.asarray(values, dtype=object)[keep].tolist() for name, values in (properties or {}).items()}
+    return {
+        'type': 'FeatureCollection',
+        'features': [{'type': 'Feature',
+                      'properties': {name: values[i] for name, values in columns.items()},
+                      'geometry': {'type': 'Point', 'coordinates': [point[1], point[0]]}}
+                     for i, point in enumerate(data.tolist())],
+    }
+
+
+def geojson_layer(collection, sidecar=None, **kwargs):
+    """GeoJsonLayer for a FeatureCollection, inlined or written to the sidecar."""
+    if sidecar is not None:
+        return GeoJsonLayer(url=sidecar.write('geojson', collection), **kwargs)
+    return GeoJsonLayer(data=collection, **kwargs)
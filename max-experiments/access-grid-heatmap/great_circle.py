@@ -0,0 +1,22 @@
+import numpy as np
+
+# Kept apart from stop_index (and its pyproj / scipy imports) so that the scraper's
+# journey_distance.py measures journeys with the same definition as the heatmaps.
+EARTH_RADIUS = 6371000  # radius of Earth in meters
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Vectorized great-circle distance in meters.
+
+    Accepts scalars or NumPy arrays (broadcast against each other), so a whole
+    column of buildings can be measured against their stations in one call.
+    """
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    delta_phi = phi2 - phi1
+    delta_lambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    a = np.sin(delta_phi / 2.0) ** 2 + \
+        np.cos(phi1) * np.cos(phi2) * np.sin(delta_lambda / 2.0) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS * c
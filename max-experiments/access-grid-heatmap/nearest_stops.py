@@ -0,0 +1,23 @@
+from stop_index import StopIndex, haversine
+
+
+def closest_stations(building_coords, station_coords, k=1, max_distance=None, workers=-1):
+    """
+    Find the closest station(s) for every building in a single bulk query.
+
+    Args:
+        building_coords: (N, 2) array-like of [lat, lon]
+        station_coords: a StopIndex, or an (M, 2) array-like of [lon, lat] (GeoJSON order,
+            as in data/stops.geojson). Pass a StopIndex when querying the same stations
+            more than once, an array builds a new index every call.
+        k (int): number of nearest stations to return per building
+        max_distance (float): optional cutoff in meters, stations further away are dropped
+        workers (int): number of threads used by the KDTree query (-1 = all cores)
+
+    Returns:
+        (distances, indices): arrays of shape (N,) when k == 1, (N, k) otherwise.
+        Distances are in meters. Missing neighbours (beyond max_distance) have
+        distance inf and index M, following scipy's KDTree convention.
+    """
+    index = station_coords if isinstance(station_coords, StopIndex) else StopIndex(station_coords)
+    return index.query(building_coords, k=k, max_distance=max_distance, workers=workers)
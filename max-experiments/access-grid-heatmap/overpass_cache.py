@@ -0,0 +1,76 @@
+import hashlib
+import os
+import time
+import numpy as np
+from overpass_stream import parse_stream, stream_query
+
+OVERPASS_URL = "http://overpass-api.de/api/interpreter"
+CACHE_DIR = 'cache/overpass'
+DEFAULT_TTL = 7 * 24 * 3600  # one week, in seconds
+
+# set OVERPASS_OFFLINE=1 to only ever serve buildings from the local cache
+OFFLINE = os.environ.get('OVERPASS_OFFLINE', '') not in ('', '0')
+
+ARRAY_KEYS = ['node_ids', 'node_lat', 'node_lon', 'way_ids', 'way_offsets', 'way_node_ids', 'way_building']
+
+
+def cache_key(overpass_query, bbox):
+    """Content address for a query: whitespace-insensitive query text plus the bounding box."""
+    query = '\n'.join(line.strip() for line in overpass_query.strip().splitlines() if line.strip())
+    bbox = ','.join(f"{float(v):.7f}" for v in bbox)
+    return hashlib.sha256(f"{query}|{bbox}".encode('utf-8')).hexdigest()[:32]
+
+
+def save(filename, buildings, fetched_at=None):
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    tmp_filename = filename + '.tmp.npz'
+    np.savez_compressed(tmp_filename, fetched_at=time.time() if fetched_at is None else fetched_at,
+                        **{key: buildings[key] for key in ARRAY_KEYS})
+    # atomic swap so an interrupted run never leaves a truncated cache entry
+    os.replace(tmp_filename, filename)
+
+
+def load(filename):
+    with np.load(filename) as npz:
+        buildings = {key: npz[key] for key in ARRAY_KEYS}
+        fetched_at = float(npz['fetched_at'])
+    return buildings, fetched_at
+
+
+def fetch_buildings(overpass_query, bbox, ttl=DEFAULT_TTL, offline=None, cache_dir=CACHE_DIR, response_file=None):
+    """
+    Run an Overpass query, going through a local content-addressed cache.
+
+    Args:
+        overpass_query (str): the Overpass QL query text
+        bbox: (south, west, north, east) bounding box used in the query
+        ttl (float): seconds before a cached entry is refetched, None to never expire
+        offline (bool): only serve from the cache, raise if the entry is missing (defaults to OVERPASS_OFFLINE)
+        cache_dir (str): where the .npz cache entries live
+        response_file (str): parse a recorded Overpass JSON response instead of calling the API
+
+    Returns:
+        dict of NumPy arrays, see overpass_stream.parse_stream()
+    """
+    if offline is None:
+        offline = OFFLINE
+
+    if response_file is not None:
+        with open(response_file, 'rb') as f:
+            return parse_stream(f)
+
+    filename = os.path.join(cache_dir, f"{cache_key(overpass_query, bbox)}.npz")
+
+    if os.path.isfile(filename):
+        buildings, fetched_at = load(filename)
+        age = time.time() - fetched_at
+        if offline or ttl is None or age < ttl:
+            print(f"Loaded {len(buildings['way_ids'])} buildings from cache ({round(age / 3600, 1)}h old)")
+            return buildings
+    elif offline:
+        raise FileNotFoundError(f"Offline mode: no cached Overpass response for this query ({filename})")
+
+    print("Fetching buildings from the Overpass API..")
+    buildings = stream_query(OVERPASS_URL, overpass_query)
+    save(filename, buildings)
+    return buildings
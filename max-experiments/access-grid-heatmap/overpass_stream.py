@@ -0,0 +1,99 @@
+import ijson
+import numpy as np
+import requests
+
+CHUNK_SIZE = 1 << 16  # bytes read from the HTTP stream at a time
+
+
+class GrowableArray:
+    """Preallocated NumPy buffer that doubles in place of appending to a Python list."""
+
+    def __init__(self, dtype, capacity=1 << 16):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self.data = np.resize(self.data, 2 * len(self.data))
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        n = len(values)
+        if self.size + n > len(self.data):
+            self.data = np.resize(self.data, max(2 * len(self.data), self.size + n))
+        self.data[self.size:self.size + n] = values
+        self.size += n
+
+    def finish(self):
+        """Trimmed copy of the filled part of the buffer."""
+        return self.data[:self.size].copy()
+
+
+def parse_stream(fileobj):
+    """
+    Incrementally parse an Overpass JSON response from a binary file-like object.
+
+    Only one element is materialised at a time; node coordinates go straight into
+    float arrays and way node lists into one flat id array, so peak memory scales
+    with the output rather than with the raw payload.
+
+    Nodes become parallel id/lat/lon arrays. Ways are stored CSR-style: the node ids
+    of way i are way_node_ids[way_offsets[i]:way_offsets[i + 1]].
+    """
+    node_ids = GrowableArray(np.int64)
+    node_lat = GrowableArray(np.float64)
+    node_lon = GrowableArray(np.float64)
+    way_ids = GrowableArray(np.int64)
+    way_offsets = GrowableArray(np.int64)
+    way_node_ids = GrowableArray(np.int64)
+    way_building = []
+
+    way_offsets.append(0)
+    for element in ijson.items(fileobj, 'elements.item', use_float=True, buf_size=CHUNK_SIZE):
+        if element['type'] == 'node':
+            node_ids.append(element['id'])
+            node_lat.append(element['lat'])
+            node_lon.append(element['lon'])
+        elif element['type'] == 'way' and 'nodes' in element:
+            way_ids.append(element['id'])
+            way_node_ids.extend(element['nodes'])
+            way_offsets.append(way_node_ids.size)
+            way_building.append(element.get('tags', {}).get('building', ''))
+
+    return {
+        'node_ids': node_ids.finish(),
+        'node_lat': node_lat.finish(),
+        'node_lon': node_lon.finish(),
+        'way_ids': way_ids.finish(),
+        'way_offsets': way_offsets.finish(),
+        'way_node_ids': way_node_ids.finish(),
+        'way_building': np.asarray(way_building, dtype=str),
+    }
+
+
+def stream_query(overpass_url, overpass_query):
+    """Run an Overpass query and parse the chunked HTTP response without buffering it."""
+    with requests.get(overpass_url, params={'data': overpass_query}, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True  # let urllib3 undo gzip transfer encoding
+        return parse_stream(response.raw)
+
+
+def resolve_way_nodes(buildings):
+    """
+    Map every entry of way_node_ids to its row in the node arrays.
+
+    Uses a sorted id array and binary search instead of an id -> coords dict.
+    Node ids that are missing from the response map to -1.
+    """
+    node_ids = buildings['node_ids']
+    order = np.argsort(node_ids, kind='stable')
+    sorted_ids = node_ids[order]
+
+    if len(sorted_ids) == 0:
+        return np.full(len(buildings['way_node_ids']), -1, dtype=np.int64)
+    positions = np.searchsorted(sorted_ids, buildings['way_node_ids'])
+    positions = np.minimum(positions, len(sorted_ids) - 1)
+    found = sorted_ids[positions] == buildings['way_node_ids']
+    return np.where(found, order[positions], -1)
@@ -1,6 +1,6 @@
 import geopandas as gpd
 import folium
-from folium.plugins import HeatMap
+from folium_layers import heat_layer
 
 # Load GeoJSON data
 arrondissements = gpd.read_file('data/arrondissements-lyon.geojson')
@@ -12,9 +12,6 @@ arrondissements = arrondissements.to_crs(stops.crs)
 # Perform a spatial join to filter stops within arrondissements
 stops_within_arrondissements = gpd.sjoin(stops, arrondissements, how='inner', op='within')
 
-# Extract coordinates for the heatmap
-heatmap_data = [[point.y, point.x] for point in stops_within_arrondissements.geometry]
-
 # Define the bounding box for the Lyon Metropolis
 minx, miny, maxx, maxy = arrondissements.total_bounds
 
@@ -37,7 +34,7 @@ folium.GeoJson(
 ).add_to(m)
 
 # Add the heatmap to the map
-HeatMap(heatmap_data).add_to(m)
+heat_layer(stops_within_arrondissements.geometry.y, stops_within_arrondissements.geometry.x).add_to(m)
 
 # Save the map
 m.save('out/lyon_stops_heatmap_with_arrondissements.html')
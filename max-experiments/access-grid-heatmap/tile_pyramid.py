@@ -0,0 +1,264 @@
+import argparse
+import os
+import sqlite3
+import struct
+import time
+import zlib
+from multiprocessing import Pool, cpu_count
+import folium
+import numpy as np
+import pandas as pd
+from branca.colormap import LinearColormap
+from scipy.ndimage import gaussian_filter
+from access_grid import ACCESS_COLORS
+from stop_index import project
+
+TILE_SIZE = 256
+# meters per pixel at zoom 0 on the equator (Web Mercator)
+EQUATOR_RESOLUTION = 156543.03392
+
+OUTAGE_COLORS = ['#ffffb2', '#fd8d3c', '#bd0026']
+
+# smallest vmax - vmin used for scaling, so constant values don't divide by zero
+MIN_VALUE_RANGE = 1e-9
+
+# set in each worker by _init_worker()
+_surface = None
+
+
+def mercator(lat, lon):
+    """WGS84 lat/lon to Web Mercator world coordinates in [0, 1) (x east, y south), as used by XYZ tiles."""
+    lat = np.radians(np.clip(np.asarray(lat, dtype=np.float64), -85.05112878, 85.05112878))
+    x = (np.asarray(lon, dtype=np.float64) + 180) / 360
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2
+    return x, y
+
+
+def tile_range(bbox, zoom):
+    """Tile columns and rows covering bbox = (min_lat, min_lon, max_lat, max_lon) at `zoom`."""
+    (x0, x1), (y1, y0) = (np.floor(np.array(c) * 2 ** zoom).astype(int)
+                          for c in mercator([bbox[0], bbox[2]], [bbox[1], bbox[3]]))
+    return range(x0, x1 + 1), range(y0, y1 + 1)
+
+
+def colorize(t, colors):
+    """Map values in [0, 1] to RGB (uint8, shape (..., 3)) along evenly spaced hex `colors`."""
+    stops = np.linspace(0, 1, len(colors))
+    rgb = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in colors], dtype=np.float64)
+    return np.stack([np.interp(t, stops, rgb[:, k]) for k in range(3)], axis=-1).astype(np.uint8)
+
+
+def png_bytes(rgba):
+    """Encode an (h, w, 4) uint8 array as a PNG file, no imaging library needed."""
+    h, w, _ = rgba.shape
+    raw = np.concatenate([np.zeros((h, 1), dtype=np.uint8), rgba.reshape(h, w * 4)], axis=1).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+
+def reference_density(lat, lon, weight, sigma):
+    """
+    99th percentile of the kernel density (weight per km²) over the occupied
+    area, from one coarse metric raster. Used as the top of the color / opacity
+    scale so every zoom level shares the same scale.
+    """
+    xy = project(lat, lon)
+    pixel = sigma / 2
+    cells = np.floor((xy - xy.min(axis=0)) / pixel).astype(np.int64)
+    shape = tuple(cells.max(axis=0) + 1)
+    raster = np.bincount(np.ravel_multi_index((cells[:, 0], cells[:, 1]), shape), weights=weight,
+                         minlength=shape[0] * shape[1]).reshape(shape)
+    density = gaussian_filter(raster, 2, mode='constant') / pixel ** 2 * 1e6
+    return float(np.percentile(density[density > 0], 99))
+
+
+class Surface:
+    """
+    Kernel-smoothed heat surface of weighted points, rendered tile by tile.
+
+    mode='mean': color is the kernel-weighted mean of `value` (e.g. the distance
+    to the nearest stop), scaled to [vmin, vmax]; opacity follows the point density.
+    mode='density': color and opacity follow the weight per km² (e.g. outages).
+
+    The kernel is a gaussian of `sigma` meters at every zoom, so all levels show
+    the same surface.
+    """
+
+    def __init__(self, lat, lon, value=None, weight=None, mode='density', sigma=60.0, vmin=0.0, vmax=None,
+                 density_scale=None, colors=OUTAGE_COLORS, opacity=0.7):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        weight = np.ones(len(lat)) if weight is None else np.asarray(weight, dtype=np.float64)
+        value = np.zeros(len(lat)) if value is None else np.asarray(value, dtype=np.float64)
+        keep = np.isfinite(lat) & np.isfinite(lon) & np.isfinite(weight) & np.isfinite(value)
+        lat, lon, weight, value = lat[keep], lon[keep], weight[keep], value[keep]
+
+        if mode not in ('mean', 'density'):
+            raise ValueError("mode must be 'mean' or 'density'")
+        self.mode = mode
+        self.sigma = sigma
+        self.vmin = vmin
+        self.vmax = float(np.percentile(value, 99)) if vmax is None and mode == 'mean' else vmax
+        self.density_scale = density_scale or reference_density(lat, lon, weight, sigma)
+        self.colors = colors
+        self.opacity = opacity
+        self.bbox = (lat.min(), lon.min(), lat.max(), lon.max())
+        # ground resolution depends on the latitude, one value is fine at city scale
+        self.cos_lat = np.cos(np.radians((self.bbox[0] + self.bbox[2]) / 2))
+
+        # points sorted by world x, a tile's points are one searchsorted slice away
+        x, y = mercator(lat, lon)
+        order = np.argsort(x)
+        self.x, self.y, self.weight, self.value = x[order], y[order], weight[order], value[order]
+
+    def resolution(self, zoom):
+        """Meters per pixel at `zoom`."""
+        return EQUATOR_RESOLUTION * self.cos_lat / 2 ** zoom
+
+    def render(self, zoom, tx, ty):
+        """RGBA array of tile (zoom, tx, ty), or None when nothing would be drawn."""
+        sigma_px = self.sigma / self.resolution(zoom)
+        margin = int(np.ceil(3 * sigma_px))
+        size = TILE_SIZE + 2 * margin
+        scale = TILE_SIZE * 2 ** zoom
+        left, top = tx * TILE_SIZE - margin, ty * TILE_SIZE - margin
+
+        start, stop = np.searchsorted(self.x, [left / scale, (left + size) / scale])
+        px = self.x[start:stop] * scale - left
+        py = self.y[start:stop] * scale - top
+        inside = (py >= 0) & (py < size)
+        if not inside.any():
+            return None
+        index = py[inside].astype(np.int64) * size + px[inside].astype(np.int64)
+        weight = self.weight[start:stop][inside]
+
+        crop = (slice(margin, margin + TILE_SIZE), slice(margin, margin + TILE_SIZE))
+        blurred = gaussian_filter(np.bincount(index, weights=weight, minlength=size * size).reshape(size, size),
+                                  sigma_px, mode='constant', truncate=3)[crop]
+        density = blurred / self.resolution(zoom) ** 2 * 1e6
+        if self.mode == 'density':
+            t = np.clip(density / self.density_scale, 0, 1)
+            alpha = t
+        else:
+            weighted = gaussian_filter(np.bincount(index, weights=weight * self.value[start:stop][inside],
+                                                   minlength=size * size).reshape(size, size),
+                                       sigma_px, mode='constant', truncate=3)[crop]
+            mean = np.divide(weighted, blurred, out=np.zeros_like(blurred), where=blurred > 1e-9)
+            t = np.clip((mean - self.vmin) / max(self.vmax - self.vmin, MIN_VALUE_RANGE), 0, 1)
+            # fully opaque from a tenth of the densest areas, fading out where there are no points
+            alpha = np.clip(density / (0.1 * self.density_scale), 0, 1)
+
+        alpha = (alpha * self.opacity * 255).astype(np.uint8)
+        if not alpha.any():
+            return None
+        return np.dstack([colorize(t, self.colors), alpha])
+
+    def colormap(self, caption):
+        if self.mode == 'density':
+            return LinearColormap(self.colors, vmin=0, vmax=self.density_scale, caption=caption)
+        return LinearColormap(self.colors, vmin=self.vmin, vmax=max(self.vmax, self.vmin + MIN_VALUE_RANGE), caption=caption)
+
+
+def _init_worker(surface):
+    global _surface
+    _surface = surface
+
+
+def _render_tile(task):
+    """Worker: render one tile and write it as <directory>/z/x/y.png, return whether it was written."""
+    directory, zoom, tx, ty = task
+    rgba = _surface.render(zoom, tx, ty)
+    if rgba is None:
+        return False
+    path = os.path.join(directory, str(zoom), str(tx))
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, f'{ty}.png'), 'wb') as f:
+        f.write(png_bytes(rgba))
+    return True
+
+
+def build_pyramid(surface, directory, min_zoom=10, max_zoom=14, processes=None, chunksize=16):
+    """
+    Render every tile of `surface` from min_zoom to max_zoom into directory/{z}/{x}/{y}.png.
+
+    Tiles are rendered in a process pool, tiles without any point within reach
+    of the kernel are skipped (Leaflet leaves them blank). Returns the number
+    of tiles written.
+
+    Past the zoom where a pixel is about sigma / 4 meters more levels add no
+    detail, let the page upscale max_zoom tiles instead (see tile_page).
+    """
+    tasks = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        columns, rows = tile_range(surface.bbox, zoom)
+        tasks.extend((directory, zoom, tx, ty) for tx in columns for ty in rows)
+
+    start_time = time.time()
+    with Pool(processes or cpu_count(), initializer=_init_worker, initargs=(surface,)) as pool:
+        written = sum(pool.imap_unordered(_render_tile, tasks, chunksize=chunksize))
+    print(f"Wrote {written} of {len(tasks)} tiles (zoom {min_zoom}-{max_zoom}) to {directory} "
+          f"in {round(time.time() - start_time, 1)}s")
+    return written
+
+
+def tile_page(path, tile_url, surface, caption, min_zoom=10, max_zoom=14, attribution='TCL / OpenStreetMap'):
+    """
+    Thin Folium page showing a pre-rendered tile pyramid over a basemap. The HTML
+    holds no data, whatever the number of points behind the tiles.
+    """
+    bbox = surface.bbox
+    m = folium.Map(location=[(bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2], zoom_start=12, max_zoom=18)
+    folium.TileLayer(tiles=tile_url, attr=attribution, name=caption, overlay=True,
+                     min_zoom=min_zoom, max_native_zoom=max_zoom, max_zoom=18).add_to(m)
+    surface.colormap(caption).add_to(m)
+    folium.LayerControl().add_to(m)
+    m.save(path)
+
+
+def building_surface(csv_filename, sigma=60.0):
+    """Mean distance to the nearest stop, from the CSV written by generate_building_heatmap(export_csv=True)."""
+    df = pd.read_csv(csv_filename, usecols=['lat', 'long', 'distance'])
+    return Surface(df['lat'], df['long'], value=df['distance'], mode='mean', sigma=sigma, colors=ACCESS_COLORS)
+
+
+def outage_surface(db_filename, sigma=60.0):
+    """Outage density, one point per outage at its stop, from the scraper's journeys.db."""
+    conn = sqlite3.connect(db_filename)
+    try:
+        df = pd.read_sql_query('''SELECT s.lat, s.lon, COUNT(*) AS outages
+                                  FROM outages o JOIN stops s ON s.id = o.stop_id
+                                  GROUP BY o.stop_id''', conn)
+    finally:
+        conn.close()
+    return Surface(df['lat'], df['lon'], weight=df['outages'], mode='density', sigma=sigma, colors=OUTAGE_COLORS)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render a heat surface to a static XYZ tile pyramid and a thin Folium page')
+    parser.add_argument('surface', choices=['buildings', 'outages'])
+    parser.add_argument('--csv', default='out/building_distances_greater_lyon_region_all_buildings.csv',
+                        help='building distances CSV (buildings surface)')
+    parser.add_argument('--db', default='../itinerary-scraping/journeys.db', help='journeys database (outages surface)')
+    parser.add_argument('--out', default='../../public-folium-maps', help='directory of the HTML page, tiles go to <out>/tiles/<name>/')
+    parser.add_argument('--name', default=None, help='name of the tile set and page (default: <surface>_heatmap)')
+    parser.add_argument('--sigma', type=float, default=60.0, help='kernel width in meters')
+    parser.add_argument('--min-zoom', type=int, default=10)
+    parser.add_argument('--max-zoom', type=int, default=14)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    name = args.name or f'{args.surface}_heatmap'
+    if args.surface == 'buildings':
+        surface = building_surface(args.csv, args.sigma)
+        caption = 'Distance to the nearest stop (m)'
+    else:
+        surface = outage_surface(args.db, args.sigma)
+        caption = 'Outages per km²'
+
+    build_pyramid(surface, os.path.join(args.out, 'tiles', name), args.min_zoom, args.max_zoom, args.processes)
+    tile_page(os.path.join(args.out, f'{name}_tiles.html'), f'tiles/{name}/{{z}}/{{x}}/{{y}}.png', surface, caption,
+              args.min_zoom, args.max_zoom)
@@ -0,0 +1,198 @@
+import hashlib
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+from overpass_stream import GrowableArray
+from stop_index import haversine, project
+
+GRAPHML_FILENAME = 'data/lyon_walk.graphml'
+CACHE_FILENAME = 'out/walking_access.npz'
+
+# csgraph drops explicit zeros, zero-length edges get this length in meters instead
+MIN_LENGTH = 1e-3
+
+# points (stops or buildings) further than this from any graph node, in meters, are
+# off the graph (e.g. outside the downloaded area) rather than walked to it in a straight line
+MAX_SNAP_DISTANCE = 300.0
+
+_GRAPHML = '{http://graphml.graphdrawing.org/xmlns}'
+
+
+def download_graphml(place='Lyon, France', filename=GRAPHML_FILENAME):
+    """Fetch the walking street graph of `place` with OSMnx once and save it as GraphML for offline use."""
+    import osmnx as ox
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    ox.save_graphml(ox.graph_from_place(place, network_type='walk'), filename)
+
+
+def _linestring(wkt):
+    """[lon, lat] pairs of a WKT 'LINESTRING (x y, x y, ...)'."""
+    return [pair.split() for pair in wkt[wkt.index('(') + 1:wkt.rindex(')')].split(',')]
+
+
+def read_graphml(filename=GRAPHML_FILENAME, geometry=False):
+    """
+    Stream an OSMnx GraphML file into flat arrays, without building a networkx graph.
+
+    Returns:
+        dict with node_id, node_lat, node_lon (one entry per node), edge_u, edge_v
+        (node positions), edge_length (meters) and, with geometry=True, the edge
+        shapes CSR-style: edge i is geometry_lat / geometry_lon[geometry_offsets[i]:geometry_offsets[i + 1]]
+    """
+    keys = {}
+    node_position = {}
+    node_id, node_lat, node_lon = GrowableArray(np.int64), GrowableArray(np.float64), GrowableArray(np.float64)
+    edge_u, edge_v, edge_length = GrowableArray(np.int64), GrowableArray(np.int64), GrowableArray(np.float64)
+    geometry_lat, geometry_lon = GrowableArray(np.float64), GrowableArray(np.float64)
+    geometry_offsets = GrowableArray(np.int64)
+    geometry_offsets.append(0)
+
+    for _, element in ET.iterparse(filename, events=('end',)):
+        tag = element.tag[len(_GRAPHML):] if element.tag.startswith(_GRAPHML) else element.tag
+        if tag == 'key':
+            keys[(element.get('for'), element.get('attr.name'))] = element.get('id')
+        elif tag == 'node':
+            data = {d.get('key'): d.text for d in element.iter(_GRAPHML + 'data')}
+            node_position[element.get('id')] = node_id.size
+            node_id.append(int(element.get('id')))
+            node_lat.append(float(data[keys['node', 'y']]))
+            node_lon.append(float(data[keys['node', 'x']]))
+            element.clear()
+        elif tag == 'edge':
+            data = {d.get('key'): d.text for d in element.iter(_GRAPHML + 'data')}
+            u, v = node_position[element.get('source')], node_position[element.get('target')]
+            length = data.get(keys.get(('edge', 'length')))
+            if length is None:
+                length = haversine(node_lat.data[u], node_lon.data[u], node_lat.data[v], node_lon.data[v])
+            edge_u.append(u)
+            edge_v.append(v)
+            edge_length.append(float(length))
+            if geometry:
+                wkt = data.get(keys.get(('edge', 'geometry')))
+                if wkt:
+                    points = np.array(_linestring(wkt), dtype=np.float64)
+                    geometry_lon.extend(points[:, 0])
+                    geometry_lat.extend(points[:, 1])
+                else:
+                    geometry_lat.extend([node_lat.data[u], node_lat.data[v]])
+                    geometry_lon.extend([node_lon.data[u], node_lon.data[v]])
+                geometry_offsets.append(geometry_lat.size)
+            element.clear()
+
+    graph = {
+        'node_id': node_id.finish(), 'node_lat': node_lat.finish(), 'node_lon': node_lon.finish(),
+        'edge_u': edge_u.finish(), 'edge_v': edge_v.finish(), 'edge_length': edge_length.finish(),
+    }
+    if geometry:
+        graph.update(geometry_lat=geometry_lat.finish(), geometry_lon=geometry_lon.finish(),
+                     geometry_offsets=geometry_offsets.finish())
+    return graph
+
+
+def _stops_hash(stop_lat, stop_lon):
+    return hashlib.blake2b(np.column_stack([stop_lat, stop_lon]).astype(np.float64).tobytes(), digest_size=8).hexdigest()
+
+
+class WalkingAccess:
+    """
+    Walking distance over the street graph from every node to the nearest stop.
+
+    Stops are snapped to their closest graph node and joined to it by a virtual
+    edge of the snapping distance, then one multi-source Dijkstra gives every
+    node its network distance to the nearest stop (and which stop that is).
+    Streets are walked both ways. Buildings, or any point, then only need a
+    nearest-node lookup (see query()). Stops and points more than max_snap
+    meters from every node are left off the graph.
+
+    Build with WalkingAccess.cached() to reuse the node distances from disk.
+    """
+
+    def __init__(self, graph, stop_lat, stop_lon, node_distance=None, nearest_stop=None, max_snap=MAX_SNAP_DISTANCE):
+        self.graph = graph
+        self.max_snap = max_snap
+        self.stop_lat = np.asarray(stop_lat, dtype=np.float64)
+        self.stop_lon = np.asarray(stop_lon, dtype=np.float64)
+        self.tree = cKDTree(project(graph['node_lat'], graph['node_lon']))
+        if node_distance is None:
+            node_distance, nearest_stop = self._solve()
+        self.node_distance = node_distance
+        self.nearest_stop = nearest_stop
+
+    def _solve(self):
+        n_nodes = len(self.graph['node_id'])
+        n_stops = len(self.stop_lat)
+        snap_distance, snap_node = self.snap(self.stop_lat, self.stop_lon)
+        attached = np.flatnonzero(snap_distance <= self.max_snap)
+
+        # both directions of every street, plus stop k -> its node as node n_nodes + k (stops close enough only)
+        u = np.concatenate([self.graph['edge_u'], self.graph['edge_v'], n_nodes + attached])
+        v = np.concatenate([self.graph['edge_v'], self.graph['edge_u'], snap_node[attached]])
+        length = np.maximum(np.concatenate([self.graph['edge_length'], self.graph['edge_length'], snap_distance[attached]]),
+                            MIN_LENGTH)
+
+        # keep the shortest of parallel edges (csr_matrix would add them up)
+        order = np.lexsort((length, v, u))
+        u, v, length = u[order], v[order], length[order]
+        first = np.ones(len(u), dtype=bool)
+        first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        size = n_nodes + n_stops
+        matrix = csr_matrix((length[first], (u[first], v[first])), shape=(size, size))
+
+        distance, _, sources = dijkstra(matrix, directed=True, indices=n_nodes + np.arange(n_stops),
+                                        min_only=True, return_predecessors=True)
+        nearest_stop = np.where(sources[:n_nodes] >= 0, sources[:n_nodes] - n_nodes, -1)
+        return distance[:n_nodes], nearest_stop
+
+    @classmethod
+    def cached(cls, stop_lat, stop_lon, graphml=GRAPHML_FILENAME, cache_filename=CACHE_FILENAME, geometry=False,
+               max_snap=MAX_SNAP_DISTANCE):
+        """
+        Graph arrays and node distances from cache_filename if it is newer than the
+        GraphML file and was computed for the same stops and max_snap, so a cache hit
+        never parses the GraphML. Otherwise read the graph, solve and save both.
+        """
+        stops_hash = _stops_hash(stop_lat, stop_lon)
+        if os.path.isfile(cache_filename) and os.path.getmtime(cache_filename) >= os.path.getmtime(graphml):
+            with np.load(cache_filename) as cache:
+                hit = (str(cache['stops_hash']) == stops_hash and 'graph_node_id' in cache.files
+                       and 'max_snap' in cache.files and float(cache['max_snap']) == max_snap
+                       and (not geometry or 'graph_geometry_offsets' in cache.files))
+                if hit:
+                    graph = {key[len('graph_'):]: cache[key] for key in cache.files if key.startswith('graph_')}
+                    return cls(graph, stop_lat, stop_lon, cache['node_distance'], cache['nearest_stop'], max_snap)
+
+        graph = read_graphml(graphml, geometry=geometry)
+        access = cls(graph, stop_lat, stop_lon, max_snap=max_snap)
+        os.makedirs(os.path.dirname(cache_filename) or '.', exist_ok=True)
+        np.savez(cache_filename, node_distance=access.node_distance, nearest_stop=access.nearest_stop,
+                 stops_hash=stops_hash, max_snap=max_snap, **{'graph_' + key: value for key, value in graph.items()})
+        return access
+
+    def snap(self, lat, lon, workers=-1):
+        """Closest graph node of each point: (great-circle meters to it, node position)."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        _, nodes = self.tree.query(project(lat, lon), workers=workers)
+        return haversine(lat, lon, self.graph['node_lat'][nodes], self.graph['node_lon'][nodes]), nodes
+
+    def query(self, lat, lon, workers=-1):
+        """
+        Walking distance to the nearest stop for arrays of points: the straight
+        line to the closest graph node plus that node's network distance.
+
+        Returns (distances, stop indices); inf and -1 where no stop is reachable,
+        or the point is more than max_snap meters from the graph.
+        """
+        snap_distance, nodes = self.snap(lat, lon, workers=workers)
+        off_graph = snap_distance > self.max_snap
+        distances = np.where(off_graph, np.inf, snap_distance + self.node_distance[nodes])
+        return distances, np.where(off_graph, -1, self.nearest_stop[nodes])
+
+    def edge_distances(self):
+        """Walking distance from the middle of every edge to the nearest stop."""
+        half = self.graph['edge_length'] / 2
+        return np.minimum(self.node_distance[self.graph['edge_u']],
+                          self.node_distance[self.graph['edge_v']]) + half
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from itinerary import ITINERARY_URL, HEADERS, itinerary_params, generate_random_coordinates, store_itinerary
+from journey_store import JourneyStore
+from raw_archive import RawArchive
+
+
+class TokenBucket:
+    """Async token bucket: on average `rate` requests per second, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def backoff_delay(attempt, base=3.0, cap=300.0):
+    """Exponential backoff with full jitter, in seconds."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def check_response(status, raw):
+    """(parsed itinerary, None) for a usable response, (None, reason it is not) otherwise."""
+    try:
+        itin = json.loads(raw)
+    except json.JSONDecodeError:
+        return None, f"HTTP {status}, not JSON: {raw[:80]!r}"
+    if not isinstance(itin, dict):
+        return None, f"HTTP {status}, unexpected response {raw[:80]!r}"
+    if 'message' in itin:
+        return None, f"API error (HTTP {status}): {itin['message']}"
+    if status != 200:
+        return None, f"HTTP {status}: {raw[:80]!r}"
+    if 'journeys' not in itin:
+        return None, f"No journeys in response {raw[:80]!r}"
+    return itin, None
+
+
+async def fetch_itinerary(session, bucket, start_loc, end_loc, url=ITINERARY_URL, max_retries=5, failures=None):
+    """
+    Fetch one itinerary, retrying with jittered exponential backoff when the API
+    answers with an error (see check_response()) or the request fails.
+
+    Returns (time_create, status, raw_text, parsed_json), or None once retries are
+    exhausted. Every failed response that came with a body is put on the
+    `failures` queue as (time_create, status, raw_text, None), to be archived.
+    """
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        try:
+            async with session.get(url, params=itinerary_params(start_loc, end_loc)) as response:
+                status = response.status
+                raw = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeDecodeError) as e:
+            print(f"Request failed ({e!r}), attempt {attempt + 1}/{max_retries + 1}")
+        else:
+            time_create = round(time.time())
+            itin, error = check_response(status, raw)
+            if error is None:
+                return time_create, status, raw, itin
+            print(f"{error}, attempt {attempt + 1}/{max_retries + 1}")
+            if failures is not None:
+                await failures.put((time_create, status, raw, None))
+        await asyncio.sleep(backoff_delay(attempt))
+    return None
+
+
+async def scrape_worker(session, bucket, queue, remaining, url):
+    while remaining is None or remaining[0] > 0:
+        if remaining is not None:
+            remaining[0] -= 1
+        # failed responses go to the writer too, which only archives them
+        result = await fetch_itinerary(session, bucket, generate_random_coordinates(), generate_random_coordinates(),
+                                       url=url, failures=queue)
+        if result is not None:
+            # blocks when the writer falls behind, which throttles the workers
+            await queue.put(result)
+
+
+def store_response(store, archive, time_create, status, raw, itin):
+    archive.append(time_create, raw, status)
+    if itin is not None:
+        store_itinerary(store, itin, time_create)
+
+
+async def db_writer(queue, in_db_thread, store, archive):
+    """
+    Archive every queued response and store the successful ones, one at a time on
+    the database thread, so SQLite never blocks the event loop. A response that
+    fails to store is reported and skipped.
+    """
+    while True:
+        item = await queue.get()
+        if item is None:
+            queue.task_done()
+            break
+        time_create, status, raw, itin = item
+        try:
+            await in_db_thread(store_response, store, archive, time_create, status, raw, itin)
+        except Exception as e:
+            print(f"Failed to store response of {time_create} ({e!r}), skipped")
+        else:
+            if itin is not None:
+                print(f"Got {len(itin['journeys'])} journeys!")
+        finally:
+            queue.task_done()
+
+
+async def scrape(concurrency=4, rate=0.5, burst=4, queue_size=32, max_requests=None,
+                 url=ITINERARY_URL, db_filename='journeys.db', archive_dir='raw', timeout=600):
+    """
+    Scrape itineraries with `concurrency` requests in flight over one pooled session.
+
+    Requests are spread out by a token bucket (`rate` per second, bursts of `burst`),
+    and parsed responses are handed to a single database writer through a bounded queue.
+    The writer does its SQLite work on one dedicated thread (a connection must stay
+    on the thread that opened it). If the writer dies, scraping stops with its error
+    rather than leaving the workers blocked on a full queue.
+    `max_requests` stops after that many itineraries (None runs forever); `url` can
+    point at a local stub server.
+    """
+    bucket = TokenBucket(rate, burst)
+    queue = asyncio.Queue(maxsize=queue_size)
+    remaining = None if max_requests is None else [max_requests]
+
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    def in_db_thread(func, *args):
+        return loop.run_in_executor(executor, func, *args)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    store = await in_db_thread(JourneyStore, db_filename)
+    try:
+        with RawArchive(archive_dir) as archive:
+            async with aiohttp.ClientSession(headers=HEADERS, connector=connector, timeout=client_timeout) as session:
+                writer = asyncio.create_task(db_writer(queue, in_db_thread, store, archive))
+                workers = [asyncio.create_task(scrape_worker(session, bucket, queue, remaining, url))
+                           for _ in range(concurrency)]
+                scraping = asyncio.gather(*workers)
+                try:
+                    await asyncio.wait([writer, scraping], return_when=asyncio.FIRST_COMPLETED)
+                    if writer.done():
+                        writer.result()
+                        raise RuntimeError("database writer stopped before the scrapers")
+                    scraping.result()
+                finally:
+                    for worker in workers:
+                        worker.cancel()
+                    await asyncio.gather(scraping, return_exceptions=True)
+                    if not writer.done():
+                        await queue.put(None)
+                        await writer
+    finally:
+        await in_db_thread(store.close)
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Concurrent TCL itinerary scraper')
+    parser.add_argument('--concurrency', type=int, default=4, help='requests in flight')
+    parser.add_argument('--rate', type=float, default=0.5, help='average requests per second')
+    parser.add_argument('--burst', type=int, default=4, help='maximum burst of requests')
+    parser.add_argument('--max-requests', type=int, default=None, help='stop after this many itineraries')
+    parser.add_argument('--url', default=ITINERARY_URL, help='itinerary API endpoint')
+    parser.add_argument('--db', default='journeys.db')
+    args = parser.parse_args()
+    asyncio.run(scrape(concurrency=args.concurrency, rate=args.rate, burst=args.burst,
+                       max_requests=args.max_requests, url=args.url, db_filename=args.db))
@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import shutil
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from journey_store import DB_FILENAME, connect
+
+EXPORT_DIR = 'parquet'
+STATE_FILENAME = '_export_state.json'
+
+# one query per dataset, every row tagged with the rowid of its source row so
+# later runs only export what was inserted since (SNAPSHOTS excepted)
+QUERIES = {
+    'journeys': '''
+        SELECT id AS rowid, id, total_duration, departure_date_time, arrival_date_time,
+               co2_value,
+               json_extract(air_pollutants, '$.values.nox') AS nox,
+               json_extract(air_pollutants, '$.values.pm') AS pm,
+               json_extract(durations, '$.walking') AS walking_duration,
+               json_extract(distances, '$.walking') AS walking_distance,
+               (SELECT COUNT(*) FROM journey_stops WHERE journey_id = journeys.id) AS n_stops
+        FROM journeys WHERE id > ? ORDER BY id LIMIT ?''',
+    # filled in after the journey is stored (see journey_distance.py), so kept out of the journeys dataset
+    'journey_distances': '''
+        SELECT id AS rowid, id, distance
+        FROM journeys WHERE distance IS NOT NULL AND id > ? ORDER BY id LIMIT ?''',
+    'stops': '''
+        SELECT rowid, id, name, lat, lon, equipments
+        FROM stops WHERE rowid > ? ORDER BY rowid LIMIT ?''',
+    # one row per outage period
+    'outages': '''
+        SELECT o.rowid, o.id, o.stop_id, o.status, o.updated_at, o.cause, o.effect,
+               p.position AS period, p.begin_at, p.end_at
+        FROM (SELECT rowid, * FROM outages WHERE rowid > ? ORDER BY rowid LIMIT ?) o
+        LEFT JOIN outage_periods p ON p.outage_id = o.id
+        ORDER BY o.rowid, p.position''',
+    'outage_events': '''
+        SELECT id AS rowid, outage_id, observed_at, status, updated_at, periods
+        FROM outage_events WHERE id > ? ORDER BY id LIMIT ?''',
+}
+
+SCHEMAS = {
+    'journeys': pa.schema([
+        ('id', pa.int64()), ('total_duration', pa.int64()),
+        ('departure_date_time', pa.timestamp('s')), ('arrival_date_time', pa.timestamp('s')),
+        ('co2_value', pa.float64()), ('nox', pa.float64()), ('pm', pa.float64()),
+        ('walking_duration', pa.float64()), ('walking_distance', pa.float64()), ('n_stops', pa.int64()),
+        ('departure_date', pa.string()),
+    ]),
+    'journey_distances': pa.schema([('id', pa.int64()), ('distance', pa.float64())]),
+    'stops': pa.schema([
+        ('id', pa.string()), ('name', pa.string()), ('lat', pa.float64()), ('lon', pa.float64()),
+        ('equipments', pa.list_(pa.string())),
+    ]),
+    'outages': pa.schema([
+        ('id', pa.string()), ('stop_id', pa.string()), ('status', pa.string()),
+        ('updated_at', pa.timestamp('s', tz='Europe/Paris')), ('cause', pa.string()), ('effect', pa.string()),
+        ('period', pa.int64()), ('begin_at', pa.timestamp('s')), ('end_at', pa.timestamp('s')),
+    ]),
+    'outage_events': pa.schema([
+        ('outage_id', pa.string()), ('observed_at', pa.timestamp('s', tz='UTC')), ('status', pa.string()),
+        ('updated_at', pa.timestamp('s', tz='Europe/Paris')), ('periods', pa.string()),
+    ]),
+}
+
+# journeys are split into departure_date=YYYY-MM-DD directories
+PARTITIONS = {'journeys': ['departure_date']}
+
+# datasets whose rows are updated in place: rewritten in full on every run
+SNAPSHOTS = {'outages', 'journey_distances'}
+
+
+def to_frame(name, df):
+    """Give a raw query result the dtypes of SCHEMAS[name]."""
+    if name == 'journeys':
+        for column in ['departure_date_time', 'arrival_date_time']:
+            df[column] = pd.to_datetime(df[column], format='%Y%m%dT%H%M%S', errors='coerce')
+        df['departure_date'] = df['departure_date_time'].dt.strftime('%Y-%m-%d').fillna('unknown')
+    elif name == 'stops':
+        df['equipments'] = [json.loads(e) if e else [] for e in df['equipments']]
+    elif name == 'outages':
+        df['updated_at'] = pd.to_datetime(df['updated_at'], utc=True, errors='coerce').dt.tz_convert('Europe/Paris')
+        for column in ['begin_at', 'end_at']:
+            df[column] = pd.to_datetime(df[column], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    elif name == 'outage_events':
+        df['observed_at'] = pd.to_datetime(df['observed_at'], unit='s', utc=True)
+        df['updated_at'] = pd.to_datetime(df['updated_at'], utc=True, errors='coerce').dt.tz_convert('Europe/Paris')
+    return df
+
+
+def load_state(directory):
+    path = os.path.join(directory, STATE_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_state(directory, state):
+    path = os.path.join(directory, STATE_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def export_table(conn, name, directory, last_rowid, chunk_size):
+    """
+    Append the rows of one dataset with rowid > last_rowid as new Parquet files.
+
+    Yields (last exported rowid, number of rows) after each chunk. Files are
+    named after the first rowid of their chunk, so re-running after a crash
+    overwrites the partial output instead of duplicating it.
+    """
+    schema = SCHEMAS[name]
+    partitioning = PARTITIONS.get(name)
+    while True:
+        df = pd.read_sql_query(QUERIES[name], conn, params=(last_rowid, chunk_size))
+        if df.empty:
+            return
+        first_rowid = int(df['rowid'].iloc[0])
+        last_rowid = int(df['rowid'].iloc[-1])
+        table = pa.Table.from_pandas(to_frame(name, df.drop(columns=['rowid'])), schema=schema, preserve_index=False)
+
+        if partitioning is None:
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+            pq.write_table(table, os.path.join(directory, name, f'part-{first_rowid}.parquet'))
+        else:
+            ds.write_dataset(table, os.path.join(directory, name), format='parquet',
+                             partitioning=partitioning, partitioning_flavor='hive',
+                             basename_template=f'part-{first_rowid}-{{i}}.parquet',
+                             existing_data_behavior='overwrite_or_ignore')
+        yield last_rowid, len(table)
+
+
+def export_snapshot(conn, name, directory, chunk_size):
+    """
+    Write the whole of one dataset to a staging directory, then swap it in for the
+    previous export. Returns the number of rows.
+    """
+    staging = os.path.join(directory, '_staging')
+    shutil.rmtree(staging, ignore_errors=True)
+    exported = sum(n_rows for _, n_rows in export_table(conn, name, staging, 0, chunk_size))
+    shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    if exported:
+        os.replace(os.path.join(staging, name), os.path.join(directory, name))
+    shutil.rmtree(staging, ignore_errors=True)
+    return exported
+
+
+def export(db_filename=DB_FILENAME, directory=EXPORT_DIR, tables=None, chunk_size=200000):
+    """
+    Export journeys.db to Parquet datasets under `directory`, appending only the
+    rows inserted since the previous run.
+
+        journeys/departure_date=YYYY-MM-DD/*.parquet   typed journey columns
+        journey_distances/*.parquet                     distance of every journey that has one, join on id
+        stops/*.parquet                                 stops with float coordinates
+        outages/*.parquet                               one row per outage period, current state
+        outage_events/*.parquet                         every observed change of an outage
+
+    Progress is recorded per dataset in _export_state.json (last exported rowid).
+    Outages are upserted as their state changes, and journey distances are
+    filled in after their journeys are stored, so these two datasets are
+    rewritten in full instead (see SNAPSHOTS).
+    """
+    os.makedirs(directory, exist_ok=True)
+    state = load_state(directory)
+    conn = connect(db_filename)
+    try:
+        for name in tables or QUERIES:
+            start_time = time.time()
+            if name in SNAPSHOTS:
+                exported = export_snapshot(conn, name, directory, chunk_size)
+                print(f"{name}: exported {exported} rows in {round(time.time() - start_time, 1)}s")
+                continue
+            exported = 0
+            for last_rowid, n_rows in export_table(conn, name, directory, state.get(name, 0), chunk_size):
+                exported += n_rows
+                state[name] = last_rowid
+                save_state(directory, state)
+            print(f"{name}: exported up to rowid {state.get(name, 0)} ({exported} new rows) in {round(time.time() - start_time, 1)}s")
+    finally:
+        conn.close()
+
+
+def load(name, directory=EXPORT_DIR, columns=None, filters=None):
+    """
+    Read an exported dataset into a DataFrame, memory-mapped, with only the given
+    columns and rows, e.g.
+
+        load('journeys', columns=['departure_date_time', 'total_duration'],
+             filters=[('departure_date', '>=', '2024-06-01')])
+    """
+    table = pq.read_table(os.path.join(directory, name), columns=columns, filters=filters, memory_map=True)
+    return table.to_pandas()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incrementally export journeys.db to Parquet')
+    parser.add_argument('--db', default=DB_FILENAME)
+    parser.add_argument('--out', default=EXPORT_DIR, help='output directory')
+    parser.add_argument('--tables', nargs='*', choices=list(QUERIES), default=None)
+    parser.add_argument('--chunk-size', type=int, default=200000)
+    args = parser.parse_args()
+    export(args.db, args.out, tables=args.tables, chunk_size=args.chunk_size)
@@ -1,49 +1,38 @@
-import osmnx as ox
+import os
+import sys
 import folium
-from folium.plugins import HeatMap
 import numpy as np
 import pandas as pd
-from shapely.geometry import Point, LineString
 import sqlite3
 
-# Connect to the SQLite database
-conn = sqlite3.connect('journeys.db')
-
-# Load the 'stops' table
-stops_df = pd.read_sql_query("SELECT * FROM stops", conn)
+sys.path.append('../access-grid-heatmap')
+from folium_layers import geojson_layer, line_collection
+from walking_access import WalkingAccess, download_graphml
 
-# Extract coordinates from the 'coord' column and convert to numeric values
-stops_df['lon'] = stops_df['coord'].apply(lambda x: float(eval(x)['lon']))
-stops_df['lat'] = stops_df['coord'].apply(lambda x: float(eval(x)['lat']))
+# Walking street graph of Lyon, downloaded once with OSMnx and then read offline
+GRAPHML_FILENAME = '../access-grid-heatmap/data/lyon_walk.graphml'
+CACHE_FILENAME = '../access-grid-heatmap/out/walking_access_scraped_stops.npz'
 
-# Keep only relevant columns
-stops_df = stops_df[['id', 'name', 'lat', 'lon']]
-
-# Define the location (Lyon, France)
-place_name = "Lyon, France"
+# Connect to the SQLite database
+conn = sqlite3.connect('journeys.db')
 
-# Retrieve all the streets in Lyon
-G = ox.graph_from_place(place_name, network_type='all')
+# Load the stops with their typed coordinates
+stops_df = pd.read_sql_query("SELECT id, name, lat, lon FROM stops WHERE lat IS NOT NULL ORDER BY id", conn)
+conn.close()
 
-# Convert the graph to a GeoDataFrame of edges
-edges = ox.graph_to_gdfs(G, nodes=False, edges=True)
+if not os.path.isfile(GRAPHML_FILENAME):
+    download_graphml("Lyon, France", GRAPHML_FILENAME)
 
-# Calculate the distance from each street segment to the nearest stop
-def distance_to_nearest_stop(geometry, stops):
-    line = LineString(geometry)
-    min_distance = np.inf
-    for _, stop in stops.iterrows():
-        point = Point(stop['lon'], stop['lat'])
-        distance = line.distance(point)
-        if distance < min_distance:
-            min_distance = distance
-    return min_distance
+# One multi-source Dijkstra from all stops, cached until the graph or the stops change
+access = WalkingAccess.cached(stops_df['lat'], stops_df['lon'], GRAPHML_FILENAME, CACHE_FILENAME, geometry=True)
 
-edges['distance_to_nearest_stop'] = edges['geometry'].apply(distance_to_nearest_stop, stops=stops_df)
+# Walking distance from the middle of each street segment to the nearest stop
+distance_to_nearest_stop = access.edge_distances()
+reachable = np.isfinite(distance_to_nearest_stop)
 
 # Normalize the distance for heatmap color coding
-edges['distance_normalized'] = (edges['distance_to_nearest_stop'] - edges['distance_to_nearest_stop'].min()) / (
-            edges['distance_to_nearest_stop'].max() - edges['distance_to_nearest_stop'].min())
+low, high = distance_to_nearest_stop[reachable].min(), distance_to_nearest_stop[reachable].max()
+distance_normalized = np.clip((distance_to_nearest_stop - low) / (high - low), 0, 1)
 
 # Create a Folium map
 m = folium.Map(location=[45.75, 4.85], zoom_start=13)
@@ -52,13 +41,13 @@ m = folium.Map(location=[45.75, 4.85], zoom_start=13)
 def get_color(distance):
     return f"#{int(255 * (1 - distance)):02x}{int(255 * distance):02x}00"
 
-# Add streets to the map with color coding
-for _, row in edges.iterrows():
-    color = get_color(row['distance_normalized'])
-    folium.GeoJson(
-        row['geometry'],
-        style_function=lambda x, color=color: {'color': color, 'weight': 2}
-    ).add_to(m)
+# Add streets to the map with color coding, as one layer (streets no stop can be walked to are grey)
+graph = access.graph
+streets = line_collection(graph['geometry_lat'], graph['geometry_lon'], graph['geometry_offsets'], properties={
+    'style': [{'color': get_color(d) if ok else '#888888'} for d, ok in zip(distance_normalized, reachable)],
+    'distance': [f'{round(d)} m' if ok else 'no stop reachable' for d, ok in zip(distance_to_nearest_stop, reachable)],
+}, decimals=5)
+geojson_layer(streets, style={'weight': 2}, style_property='style', tooltip='distance').add_to(m)
 
 # Save map to an HTML file
 m.save('lyon_streets_heatmap.html')
@@ -0,0 +1,120 @@
+import random
+import requests
+
+# Function to process the journey data
+def process_journey(data):
+    stops = []
+    for section in data.get('sections', []):
+        if section.get('type') == 'public_transport':
+            stops.append({
+                "stop_point": section['from']['stop_point']['name'],
+                "stop_id": section['from']['stop_point'].get('id'),
+                "arrival_date_time": section['departure_date_time'],
+                "departure_date_time": section['arrival_date_time']
+            })
+            stops.append({
+                "stop_point": section['to']['stop_point']['name'],
+                "stop_id": section['to']['stop_point'].get('id'),
+                "arrival_date_time": section['arrival_date_time'],
+                "departure_date_time": None
+            })
+    simplified_journey = {
+        "total_duration": data.get("duration"),
+        "departure_date_time": data.get("departure_date_time"),
+        "arrival_date_time": data.get("arrival_date_time"),
+        "co2_emission": data.get("co2_emission"),
+        "air_pollutants": data.get("air_pollutants"),
+        "durations": data.get("durations"),
+        "distances": data.get("distances"),
+        "stops": stops
+    }
+    return simplified_journey
+
+# Function to extract non-journey-specific data
+def extract_stops_data(data):
+    stops_info = {}
+    outages_info = {}
+    for section in data.get('sections', []):
+        stop_points = [section.get('from', {}).get('stop_point'), section.get('to', {}).get('stop_point')]
+        for stop_point in stop_points:
+            if not stop_point:
+                continue
+            stop_id = stop_point['id']
+            if not stop_id in stops_info:
+                stops_info[stop_id] = {
+                    "id": stop_point.get("id"),
+                    "name": stop_point.get("name"),
+                    "coord": stop_point.get("coord"),
+                    "equipments": stop_point.get("equipments"),
+                }
+                outage = stop_point.get("equipment_details")
+                if outage:
+                    outage = outage[0]
+                    outage['stop_id'] = stop_id  # Ensure 'stop_id' is added to the outage data
+                    if not outage['id'] in outages_info:
+                        outages_info[outage['id']] = {
+                            "id": outage['id'],
+                            "stop_id": stop_id,
+                            "status": outage['current_availability']['status'],
+                            "updated_at": outage['current_availability']['updated_at'],
+                            "info": {
+                                "cause": outage['current_availability']['cause'],
+                                "effect": outage['current_availability']['effect'],
+                                "periods": outage['current_availability']['periods']
+                            }
+                        }
+    return stops_info, outages_info
+
+# Queue every journey, stop and outage of one itinerary response and write them in one transaction
+def store_itinerary(store, itin, observed_at=None):
+    for journey in itin['journeys']:
+        simplified = process_journey(journey)
+        if not store.journey_exists(simplified):
+            store.add_journey(simplified)
+        
+        stops, outages = extract_stops_data(journey)
+        
+        for stop_id, stop in stops.items():
+            store.add_stop(stop)
+        
+        for outage_id, outage in outages.items():
+            store.add_outage(outage, observed_at)
+    
+    store.flush()
+
+ITINERARY_URL = "https://carte.tcl.fr/api/itinerary"
+MODES_TRANSIT = "departure,metro,funiculaire,tramway,bus"
+
+def itinerary_params(start_loc, end_loc, modes_transit=MODES_TRANSIT):
+    return {
+        "datetime": "now",
+        "from": start_loc,
+        "to": end_loc,
+        "params": modes_transit,
+        "walking": "0.5",
+    }
+
+HEADERS = {
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Cookie": "hasAuthorizedCookies=true",
+    "Referer": "https://carte.tcl.fr/route-calculation?from=4.8838;45.7475&to=4.8852;45.7581",
+    "sec-ch-ua": '"Chromium";v="124", "Google Chrome";v="124", "Not-A.Brand";v="99"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Windows"',
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-origin",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+}
+
+def get_itinerary(start_loc="4.8838;45.7475", end_loc="4.8852;45.7581", modes_transit=MODES_TRANSIT):
+    response = requests.get(ITINERARY_URL, headers=HEADERS, params=itinerary_params(start_loc, end_loc, modes_transit), timeout=600)
+    return response.text
+
+def generate_random_coordinates():
+    min_lat, max_lat = 45.8092, 45.7155
+    min_lon, max_lon = 4.7951, 4.9200
+    lat = random.uniform(min_lat, max_lat)
+    lon = random.uniform(min_lon, max_lon)
+    return f"{round(lon, 4)};{round(lat, 4)}"
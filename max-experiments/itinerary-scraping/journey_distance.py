@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'access-grid-heatmap'))
+from great_circle import haversine
+
+
+def load_stop_coords(conn):
+    """Return ({stop_id: index}, lat array, lon array) for every stop with coordinates."""
+    rows = conn.execute('SELECT id, lat, lon FROM stops WHERE lat IS NOT NULL AND lon IS NOT NULL').fetchall()
+    index = {stop_id: i for i, (stop_id, _, _) in enumerate(rows)}
+    lat = np.array([row[1] for row in rows], dtype=np.float64)
+    lon = np.array([row[2] for row in rows], dtype=np.float64)
+    return index, lat, lon
+
+
+def journey_distances(journey_ids, stop_journeys, stop_indices, lat, lon):
+    """
+    Sum the leg-by-leg great-circle distance of each journey.
+
+    stop_journeys / stop_indices hold one entry per journey stop, sorted by
+    journey and position; stops without coordinates (index -1) are skipped, so
+    the leg goes straight from the previous known stop to the next one.
+    Journeys with fewer than two known stops have no leg and get NaN.
+    """
+    slots = np.searchsorted(journey_ids, stop_journeys)
+    known = (stop_indices >= 0) & (slots < len(journey_ids))
+    known[known] = journey_ids[slots[known]] == stop_journeys[known]
+    slots, stop_indices = slots[known], stop_indices[known]
+
+    same_journey = slots[1:] == slots[:-1]
+    a, b = stop_indices[:-1][same_journey], stop_indices[1:][same_journey]
+    legs = haversine(lat[a], lon[a], lat[b], lon[b])
+    distances = np.bincount(slots[1:][same_journey], weights=legs, minlength=len(journey_ids)).astype(np.float64)
+    n_legs = np.bincount(slots[1:][same_journey], minlength=len(journey_ids))
+    distances[n_legs == 0] = np.nan
+    return distances
+
+
+def update_journey_distances(conn, batch_size=20000, coords=None, after_id=-1):
+    """
+    Fill journeys.distance (meters) for the journeys with id > after_id that don't
+    have one yet.
+
+    Journeys are processed in id order, batch_size at a time, and every batch is
+    committed on its own, so the job can be interrupted and resumed. Journeys
+    without a leg between two stops with coordinates stay NULL, to be tried again
+    once more stops are known. Returns the number of journeys given a distance.
+    """
+    index, lat, lon = coords if coords is not None else load_stop_coords(conn)
+    n_updated = 0
+    last_id = after_id
+    while True:
+        journey_ids = np.array([row[0] for row in conn.execute(
+            'SELECT id FROM journeys WHERE distance IS NULL AND id > ? ORDER BY id LIMIT ?', (last_id, batch_size))], dtype=np.int64)
+        if not len(journey_ids):
+            break
+        last_id = int(journey_ids[-1])
+
+        rows = conn.execute('''SELECT journey_id, stop_id FROM journey_stops
+                               WHERE journey_id BETWEEN ? AND ?
+                               ORDER BY journey_id, position''', (int(journey_ids[0]), last_id)).fetchall()
+        stop_journeys = np.array([row[0] for row in rows], dtype=np.int64)
+        stop_indices = np.array([index.get(row[1], -1) for row in rows], dtype=np.int64)
+
+        distances = journey_distances(journey_ids, stop_journeys, stop_indices, lat, lon)
+        found = ~np.isnan(distances)
+        if found.any():
+            with conn:
+                conn.executemany('UPDATE journeys SET distance = ? WHERE id = ?',
+                                 zip(distances[found].tolist(), journey_ids[found].tolist()))
+        n_updated += int(found.sum())
+    return n_updated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute the distance of journeys that do not have one yet')
+    parser.add_argument('--db', default='journeys.db')
+    parser.add_argument('--batch-size', type=int, default=20000)
+    args = parser.parse_args()
+
+    from journey_store import connect  # journey_store imports this module
+    conn = connect(args.db)
+    start_time = time.time()
+    n = update_journey_distances(conn, batch_size=args.batch_size)
+    conn.close()
+    print(f"Updated {n} journeys in {round(time.time() - start_time, 1)}s")
@@ -0,0 +1,492 @@
+import hashlib
+import json
+import math
+import sqlite3
+import time
+from journey_distance import load_stop_coords, update_journey_distances
+import outage_stats
+
+DB_FILENAME = 'journeys.db'
+
+# WAL lets the analysis notebooks read while the scraper writes, and with
+# synchronous=NORMAL a commit costs no fsync (the WAL is synced at checkpoints).
+# A crash can lose the last few commits but never corrupts the database.
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    'cache_size': -20000,  # ~20 MB page cache
+    'busy_timeout': 5000,  # ms to wait on a reader holding a lock
+}
+
+
+def create_db(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS journeys (
+                    id INTEGER PRIMARY KEY,
+                    total_duration INTEGER,
+                    departure_date_time TEXT,
+                    arrival_date_time TEXT,
+                    co2_emission REAL,
+                    air_pollutants TEXT,
+                    durations TEXT,
+                    distances TEXT,
+                    stops TEXT,
+                    stops_hash TEXT,
+                    co2_value REAL,
+                    distance REAL
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS stops (
+                    id TEXT PRIMARY KEY,
+                    name TEXT,
+                    coord TEXT,
+                    equipments TEXT,
+                    lat REAL,
+                    lon REAL
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS outages (
+                    id TEXT PRIMARY KEY,
+                    stop_id TEXT,
+                    status TEXT,
+                    updated_at TEXT,
+                    info TEXT,
+                    cause TEXT,
+                    effect TEXT,
+                    period_begin TEXT,
+                    period_end TEXT,
+                    state_hash TEXT,
+                    first_seen INTEGER,
+                    last_seen INTEGER
+                )''')
+    # one row per public transport stop of a journey, in travel order
+    c.execute('''CREATE TABLE IF NOT EXISTS journey_stops (
+                    journey_id INTEGER NOT NULL REFERENCES journeys (id),
+                    position INTEGER NOT NULL,
+                    stop_id TEXT REFERENCES stops (id),
+                    stop_name TEXT,
+                    arrival_date_time TEXT,
+                    departure_date_time TEXT,
+                    PRIMARY KEY (journey_id, position)
+                ) WITHOUT ROWID''')
+    # every period of an outage, times as 'YYYY-MM-DD HH:MM:SS' (local time)
+    c.execute('''CREATE TABLE IF NOT EXISTS outage_periods (
+                    outage_id TEXT NOT NULL REFERENCES outages (id),
+                    position INTEGER NOT NULL,
+                    begin_at TEXT,
+                    end_at TEXT,
+                    PRIMARY KEY (outage_id, position)
+                ) WITHOUT ROWID''')
+    # append-only log of every distinct state an outage was observed in,
+    # observed_at is the unix time of the response that reported it
+    c.execute('''CREATE TABLE IF NOT EXISTS outage_events (
+                    id INTEGER PRIMARY KEY,
+                    outage_id TEXT NOT NULL,
+                    observed_at INTEGER,
+                    status TEXT,
+                    updated_at TEXT,
+                    periods TEXT,
+                    state_hash TEXT
+                )''')
+    outage_stats.create_rollups(conn)
+    conn.commit()
+    migrate_stops_hash(conn)
+    migrate_normalized(conn)
+    migrate_distance(conn)
+    migrate_outage_rollups(conn)
+    migrate_outage_events(conn)
+
+
+def add_columns(conn, table, columns):
+    existing = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    for name, sql_type in columns:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {sql_type}')
+
+
+def navitia_to_iso(column):
+    """SQL expression turning a 'YYYYMMDDTHHMMSS' column into 'YYYY-MM-DD HH:MM:SS'."""
+    return (f"substr({column}, 1, 4) || '-' || substr({column}, 5, 2) || '-' || substr({column}, 7, 2) || ' ' || "
+            f"substr({column}, 10, 2) || ':' || substr({column}, 12, 2) || ':' || substr({column}, 14, 2)")
+
+
+def migrate_normalized(conn):
+    """
+    Bring a database from the JSON-in-TEXT layout to the typed schema (user_version 2).
+
+    The original JSON columns are kept so existing readers keep working; the typed
+    columns and child tables are backfilled from them with SQLite's JSON functions.
+    """
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= 2:
+        return
+
+    with conn:
+        add_columns(conn, 'journeys', [('co2_value', 'REAL')])
+        add_columns(conn, 'stops', [('lat', 'REAL'), ('lon', 'REAL')])
+        add_columns(conn, 'outages', [('cause', 'TEXT'), ('effect', 'TEXT'), ('period_begin', 'TEXT'), ('period_end', 'TEXT')])
+
+        conn.execute('''UPDATE journeys SET co2_value = json_extract(co2_emission, '$.value')
+                        WHERE co2_value IS NULL AND json_valid(co2_emission)''')
+        conn.execute('''UPDATE stops SET lat = CAST(json_extract(coord, '$.lat') AS REAL),
+                                         lon = CAST(json_extract(coord, '$.lon') AS REAL)
+                        WHERE lat IS NULL AND json_valid(coord)''')
+        conn.execute(f'''UPDATE outages SET cause = json_extract(info, '$.cause.label'),
+                                           effect = json_extract(info, '$.effect.label'),
+                                           period_begin = {navitia_to_iso("json_extract(info, '$.periods[0].begin')")},
+                                           period_end = {navitia_to_iso("json_extract(info, '$.periods[0].end')")}
+                         WHERE cause IS NULL AND json_valid(info)''')
+        conn.execute(f'''INSERT OR IGNORE INTO outage_periods (outage_id, position, begin_at, end_at)
+                         SELECT o.id, p.key,
+                                {navitia_to_iso("json_extract(p.value, '$.begin')")},
+                                {navitia_to_iso("json_extract(p.value, '$.end')")}
+                         FROM outages o, json_each(o.info, '$.periods') p
+                         WHERE json_valid(o.info)''')
+
+        # older journeys only stored stop names, resolve them to ids through the stops table
+        conn.execute('CREATE TEMP TABLE stop_ids AS SELECT name, MIN(id) AS id FROM stops GROUP BY name')
+        conn.execute('CREATE INDEX temp.stop_ids_name ON stop_ids (name)')
+        conn.execute('''INSERT OR IGNORE INTO journey_stops (journey_id, position, stop_id, stop_name, arrival_date_time, departure_date_time)
+                        SELECT j.id, s.key,
+                               COALESCE(json_extract(s.value, '$.stop_id'),
+                                        (SELECT id FROM stop_ids WHERE name = json_extract(s.value, '$.stop_point'))),
+                               json_extract(s.value, '$.stop_point'),
+                               json_extract(s.value, '$.arrival_date_time'),
+                               json_extract(s.value, '$.departure_date_time')
+                        FROM journeys j, json_each(j.stops) s
+                        WHERE json_valid(j.stops)''')
+        conn.execute('DROP TABLE temp.stop_ids')
+
+        create_indexes(conn)
+        conn.execute('PRAGMA user_version = 2')
+
+
+def migrate_distance(conn):
+    """Add the indexed journeys.distance column (user_version 3) and fill it for existing journeys."""
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= 3:
+        return
+
+    with conn:
+        add_columns(conn, 'journeys', [('distance', 'REAL')])
+        conn.execute('CREATE INDEX IF NOT EXISTS journeys_distance ON journeys (distance)')
+    update_journey_distances(conn)
+    with conn:
+        conn.execute('PRAGMA user_version = 3')
+
+
+def migrate_outage_rollups(conn):
+    """Fill outage_rollups (user_version 4) from the outages stored before it existed."""
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= 4:
+        return
+
+    with conn:
+        outage_stats.rebuild_rollups(conn)
+        conn.execute('PRAGMA user_version = 4')
+
+
+def migrate_outage_events(conn):
+    """
+    Start the outage event log (user_version 5).
+
+    Outages stored so far only have their first snapshot, which becomes their
+    first event, observed at the time it was last updated.
+    """
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= 5:
+        return
+
+    with conn:
+        add_columns(conn, 'outages', [('state_hash', 'TEXT'), ('first_seen', 'INTEGER'), ('last_seen', 'INTEGER')])
+        rows = conn.execute('SELECT id, status, updated_at, info FROM outages WHERE state_hash IS NULL').fetchall()
+        events = []
+        for outage_id, status, updated_at, info in rows:
+            periods = (json.loads(info) if info else {}).get('periods') or []
+            events.append((outage_id, status, updated_at, json.dumps(periods), outage_state_digest(status, updated_at, periods)))
+        conn.executemany('''INSERT INTO outage_events (outage_id, observed_at, status, updated_at, periods, state_hash)
+                            VALUES (?1, CAST(strftime('%s', ?3) AS INTEGER), ?2, ?3, ?4, ?5)''', events)
+        conn.executemany('''UPDATE outages SET state_hash = ?, first_seen = CAST(strftime('%s', updated_at) AS INTEGER),
+                                               last_seen = CAST(strftime('%s', updated_at) AS INTEGER)
+                            WHERE id = ?''', [(digest, outage_id) for outage_id, _, _, _, digest in events])
+        create_indexes(conn)
+        conn.execute('PRAGMA user_version = 5')
+
+
+def create_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS journeys_departure ON journeys (departure_date_time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS journey_stops_stop ON journey_stops (stop_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS stops_name ON stops (name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS outages_stop ON outages (stop_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS outages_updated_at ON outages (updated_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS outage_periods_begin ON outage_periods (begin_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS outage_events_outage ON outage_events (outage_id, observed_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS outage_events_observed_at ON outage_events (observed_at)')
+
+
+DIGEST_FIELDS = ('stop_point', 'arrival_date_time', 'departure_date_time')
+
+
+def stops_digest(stops):
+    """
+    Stable digest of a journey's stop sequence, used to deduplicate journeys.
+
+    Only the stop names and times are hashed, so digests stay comparable with
+    rows written before stop ids were recorded.
+    """
+    stops = [{field: stop.get(field) for field in DIGEST_FIELDS} for stop in stops]
+    canonical = json.dumps(stops, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def migrate_stops_hash(conn, batch_size=10000):
+    """
+    Add the indexed stops_hash column to journeys and backfill it for existing rows.
+
+    Older databases may hold the same stop sequence more than once; only the first
+    (lowest id) copy gets a hash, later copies keep NULL so the UNIQUE index holds.
+    """
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(journeys)')]
+    if 'stops_hash' not in columns:
+        conn.execute('ALTER TABLE journeys ADD COLUMN stops_hash TEXT')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS journeys_stops_hash ON journeys (stops_hash)')
+    conn.commit()
+
+    last_id = -1
+    while True:
+        rows = conn.execute('''SELECT id, stops FROM journeys WHERE stops_hash IS NULL AND id > ?
+                               ORDER BY id LIMIT ?''', (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        with conn:
+            conn.executemany('UPDATE OR IGNORE journeys SET stops_hash = ? WHERE id = ?',
+                             [(stops_digest(json.loads(stops)), journey_id) for journey_id, stops in rows])
+        last_id = rows[-1][0]
+
+
+def outage_state_digest(status, updated_at, periods):
+    """Digest of the parts of an outage that change over its lifetime."""
+    canonical = json.dumps([status, updated_at, periods], sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class BloomFilter:
+    """
+    Small in-memory Bloom filter over hex digests.
+
+    A negative answer is certain, so most new journeys skip the SQLite lookup;
+    a positive answer still has to be confirmed against the database.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        # standard sizing: m = -n ln(p) / ln(2)^2 bits, k = m/n ln(2) hashes
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, digest):
+        # double hashing on two 64-bit halves of the digest
+        h1 = int(digest[:16], 16)
+        h2 = int(digest[16:32], 16) | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, digest):
+        for pos in self._positions(digest):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, digest):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+
+def connect(filename=DB_FILENAME):
+    conn = sqlite3.connect(filename)
+    for pragma, value in PRAGMAS.items():
+        conn.execute(f'PRAGMA {pragma} = {value}')
+    create_db(conn)
+    return conn
+
+
+def navitia_time_to_iso(value):
+    """'YYYYMMDDTHHMMSS' -> 'YYYY-MM-DD HH:MM:SS', same as navitia_to_iso() in SQL."""
+    if not value:
+        return None
+    return f"{value[0:4]}-{value[4:6]}-{value[6:8]} {value[9:11]}:{value[11:13]}:{value[13:15]}"
+
+
+def journey_row(journey):
+    co2 = journey['co2_emission']
+    return (journey['total_duration'], journey['departure_date_time'], journey['arrival_date_time'],
+            json.dumps(co2), json.dumps(journey['air_pollutants']),
+            json.dumps(journey['durations']), json.dumps(journey['distances']), json.dumps(journey['stops']),
+            co2.get('value') if isinstance(co2, dict) else None,
+            stops_digest(journey['stops']))
+
+
+def journey_stop_rows(journey, digest):
+    return [(position, stop.get('stop_id'), stop['stop_point'], stop['arrival_date_time'], stop['departure_date_time'], digest)
+            for position, stop in enumerate(journey['stops'])]
+
+
+def stop_row(stop):
+    coord = stop['coord'] or {}
+    lat = float(coord['lat']) if coord.get('lat') is not None else None
+    lon = float(coord['lon']) if coord.get('lon') is not None else None
+    return (stop['id'], stop['name'], json.dumps(stop['coord']), json.dumps(stop['equipments']), lat, lon)
+
+
+def outage_row(outage, observed_at):
+    info = outage['info']
+    periods = info.get('periods') or []
+    first_period = periods[0] if periods else {}
+    return (outage['id'], outage['stop_id'], outage['status'], outage['updated_at'], json.dumps(info),
+            (info.get('cause') or {}).get('label'), (info.get('effect') or {}).get('label'),
+            navitia_time_to_iso(first_period.get('begin')), navitia_time_to_iso(first_period.get('end')),
+            outage_state_digest(outage['status'], outage['updated_at'], periods), observed_at, json.dumps(periods))
+
+
+class JourneyStore:
+    """
+    Buffered writer for journeys.db over a single persistent connection.
+
+    Rows are queued in memory and written with executemany in one transaction,
+    either when flush() is called (once per itinerary response) or when the
+    buffer gets too old or too large. Use it as a context manager so the last
+    batch is flushed on exit.
+    """
+
+    def __init__(self, filename=DB_FILENAME, flush_interval=30.0, max_buffered=1000, use_bloom_filter=True):
+        self.conn = connect(filename)
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.journeys = []
+        self.journey_stops = []
+        self.stops = []
+        self.outages = []  # [outage_row(), last time seen in that state]
+        self.outage_positions = {}  # outage id -> index of its latest entry in self.outages
+        self.pending_hashes = set()  # stops_hash of buffered journeys
+        self.stop_coords = None  # cached load_stop_coords(), reset when new stops are written
+        self.last_flush = time.monotonic()
+
+        self.bloom = None
+        if use_bloom_filter:
+            known = self.conn.execute('SELECT COUNT(*) FROM journeys').fetchone()[0]
+            self.bloom = BloomFilter(capacity=max(1000000, 2 * known))
+            for (digest,) in self.conn.execute('SELECT stops_hash FROM journeys WHERE stops_hash IS NOT NULL'):
+                self.bloom.add(digest)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.journeys) + len(self.stops) + len(self.outages)
+
+    def journey_exists(self, journey):
+        digest = stops_digest(journey['stops'])
+        if digest in self.pending_hashes:
+            return True
+        if self.bloom is not None and digest not in self.bloom:
+            return False
+        c = self.conn.execute('''SELECT id FROM journeys WHERE stops_hash = ?''', (digest,))
+        return c.fetchone() is not None
+
+    def add_journey(self, journey):
+        """Queue a journey; duplicates of a stored stop sequence are dropped by INSERT OR IGNORE."""
+        row = journey_row(journey)
+        if row[-1] in self.pending_hashes:
+            return
+        self.journeys.append(row)
+        self.journey_stops.extend(journey_stop_rows(journey, row[-1]))
+        self.pending_hashes.add(row[-1])
+        if self.bloom is not None:
+            self.bloom.add(row[-1])
+        self.maybe_flush()
+
+    def add_stop(self, stop):
+        self.stops.append(stop_row(stop))
+        self.maybe_flush()
+
+    def add_outage(self, outage, observed_at=None):
+        """
+        Queue an outage as seen at `observed_at` (unix time, defaults to now).
+
+        The outages table holds the latest state of each outage, and every
+        change of status, update time or periods is appended to outage_events.
+        """
+        if observed_at is None:
+            observed_at = round(time.time())
+        row = outage_row(outage, observed_at)
+        position = self.outage_positions.get(row[0])
+        if position is not None and self.outages[position][0][9] == row[9]:
+            # same state as the last sighting, only extend it
+            self.outages[position][1] = max(self.outages[position][1], observed_at)
+        else:
+            self.outage_positions[row[0]] = len(self.outages)
+            self.outages.append([row, observed_at])
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if len(self) >= self.max_buffered or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write every buffered row in a single transaction, then fill in the new journeys' distances."""
+        if len(self):
+            last_id = self.conn.execute('SELECT COALESCE(MAX(id), -1) FROM journeys').fetchone()[0]
+            with self.conn:
+                self.conn.executemany('''INSERT OR IGNORE INTO stops (id, name, coord, equipments, lat, lon)
+                                         VALUES (?, ?, ?, ?, ?, ?)''', self.stops)
+                self.conn.executemany('''INSERT OR IGNORE INTO journeys (total_duration, departure_date_time, arrival_date_time, co2_emission, air_pollutants, durations, distances, stops, co2_value, stops_hash)
+                                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', self.journeys)
+                # journey ids are only known after the insert, look them up by digest
+                self.conn.executemany('''INSERT OR IGNORE INTO journey_stops (journey_id, position, stop_id, stop_name, arrival_date_time, departure_date_time)
+                                         SELECT id, ?, ?, ?, ?, ? FROM journeys WHERE stops_hash = ?''', self.journey_stops)
+                for row, last_seen in self.outages:
+                    self.write_outage(row, last_seen)
+            n_known = None if self.stop_coords is None else len(self.stop_coords[1])
+            if self.stops:
+                self.stop_coords = None
+            if self.journeys:
+                if self.stop_coords is None:
+                    self.stop_coords = load_stop_coords(self.conn)
+                # older journeys still without a distance only need another look once new stops have coordinates
+                after_id = last_id if n_known == len(self.stop_coords[1]) else -1
+                update_journey_distances(self.conn, coords=self.stop_coords, after_id=after_id)
+            self.journeys.clear()
+            self.journey_stops.clear()
+            self.stops.clear()
+            self.outages.clear()
+            self.outage_positions.clear()
+            self.pending_hashes.clear()
+        self.last_flush = time.monotonic()
+
+    def write_outage(self, row, last_seen):
+        """Log the outage's state if it differs from its last event, then upsert its current state and periods."""
+        outage_id, _, status, updated_at = row[:4]
+        digest, observed_at, periods = row[9:]
+        self.conn.execute('''INSERT INTO outage_events (outage_id, observed_at, status, updated_at, periods, state_hash)
+                             SELECT ?1, ?2, ?3, ?4, ?5, ?6
+                             WHERE ?6 IS NOT (SELECT state_hash FROM outage_events WHERE outage_id = ?1
+                                              ORDER BY observed_at DESC, id DESC LIMIT 1)''',
+                          (outage_id, observed_at, status, updated_at, periods, digest))
+        changed = self.conn.execute('''INSERT INTO outages (id, stop_id, status, updated_at, info, cause, effect, period_begin, period_end, state_hash, first_seen, last_seen)
+                                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                       ON CONFLICT (id) DO UPDATE SET
+                                           status = excluded.status, updated_at = excluded.updated_at, info = excluded.info,
+                                           cause = excluded.cause, effect = excluded.effect,
+                                           period_begin = excluded.period_begin, period_end = excluded.period_end,
+                                           state_hash = excluded.state_hash, last_seen = MAX(COALESCE(last_seen, 0), excluded.last_seen)
+                                       WHERE (outages.updated_at IS NULL OR excluded.updated_at >= outages.updated_at)
+                                         AND excluded.state_hash IS NOT outages.state_hash''',
+                                    row[:11] + (last_seen,)).rowcount
+        if changed:
+            self.conn.execute('DELETE FROM outage_periods WHERE outage_id = ?', (outage_id,))
+            self.conn.execute(f'''INSERT INTO outage_periods (outage_id, position, begin_at, end_at)
+                                  SELECT ?1, p.key,
+                                         {navitia_to_iso("json_extract(p.value, '$.begin')")},
+                                         {navitia_to_iso("json_extract(p.value, '$.end')")}
+                                  FROM json_each(?2) p''', (outage_id, periods))
+        else:
+            # same state as stored, or an older snapshot seen after a newer one
+            self.conn.execute('UPDATE outages SET last_seen = MAX(COALESCE(last_seen, 0), ?) WHERE id = ?', (last_seen, outage_id))
+
+    def close(self):
+        self.flush()
+        self.conn.close()
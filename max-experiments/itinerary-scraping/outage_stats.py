@@ -0,0 +1,132 @@
+import pandas as pd
+
+# Rollup buckets, as SQL expressions over an outages row. updated_at looks like
+# '2024-05-25T10:15:00+02:00', the hour and date are taken from the local time
+# as written (strftime() would convert to UTC). Weekdays are 0 = Monday, like pandas.
+DIMENSIONS = {
+    'stop': '{o}.stop_id',
+    'date': 'substr({o}.updated_at, 1, 10)',
+    'hour': 'CAST(substr({o}.updated_at, 12, 2) AS INTEGER)',
+    'weekday': "(CAST(strftime('%w', substr({o}.updated_at, 1, 10)) AS INTEGER) + 6) % 7",
+    'weekday_hour': "((CAST(strftime('%w', substr({o}.updated_at, 1, 10)) AS INTEGER) + 6) % 7) * 24 + CAST(substr({o}.updated_at, 12, 2) AS INTEGER)",
+    'cause': '{o}.cause',
+    'effect': '{o}.effect',
+    'duration_hours': 'CAST(({duration}) / 3600 AS INTEGER)',
+}
+
+# outages with no value for a dimension are counted in this bucket
+UNKNOWN = 'unknown'
+
+# length of the first period in seconds, NULL when the outage has no period
+DURATION = "(strftime('%s', {o}.period_end) - strftime('%s', {o}.period_begin))"
+
+
+def bucket_sql(dimension, o):
+    expression = DIMENSIONS[dimension].format(o=o, duration=DURATION.format(o=o))
+    return f"COALESCE({expression}, '{UNKNOWN}')"
+
+
+def rollup_statements(o, sign):
+    """One upsert per dimension adding (sign=1) or removing (sign=-1) outage row `o` from its buckets."""
+    duration = DURATION.format(o=o)
+    return [
+        f'''INSERT INTO outage_rollups (dimension, bucket, n, n_timed, total_duration)
+            SELECT '{dimension}', {bucket_sql(dimension, o)}, {sign},
+                   {sign} * (({duration}) IS NOT NULL), {sign} * COALESCE({duration}, 0)
+            WHERE true
+            ON CONFLICT (dimension, bucket) DO UPDATE SET n = n + excluded.n,
+                                                          n_timed = n_timed + excluded.n_timed,
+                                                          total_duration = total_duration + excluded.total_duration;'''
+        for dimension in DIMENSIONS
+    ]
+
+
+def create_rollups(conn):
+    """
+    Create the outage_rollups table and the triggers that keep it up to date.
+
+    Every outage inserted into the outages table adds 1 to the count of its
+    bucket in each dimension, and its duration to the bucket's total, so
+    reading a series costs O(buckets) whatever the number of outages. When an
+    outage's current state is updated it moves from its old buckets to the new ones.
+    """
+    conn.execute('''CREATE TABLE IF NOT EXISTS outage_rollups (
+                        dimension TEXT NOT NULL,
+                        bucket,
+                        n INTEGER NOT NULL,
+                        n_timed INTEGER NOT NULL,
+                        total_duration REAL NOT NULL,
+                        PRIMARY KEY (dimension, bucket)
+                    ) WITHOUT ROWID''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS outages_rollup AFTER INSERT ON outages
+                     BEGIN
+                         {' '.join(rollup_statements('NEW', 1))}
+                     END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS outages_rollup_update
+                     AFTER UPDATE OF stop_id, updated_at, cause, effect, period_begin, period_end ON outages
+                     BEGIN
+                         {' '.join(rollup_statements('OLD', -1))}
+                         {' '.join(rollup_statements('NEW', 1))}
+                         DELETE FROM outage_rollups WHERE n = 0;
+                     END''')
+
+
+def rebuild_rollups(conn):
+    """Recompute outage_rollups from the outages table (one GROUP BY per dimension)."""
+    duration = DURATION.format(o='o')
+    conn.execute('DELETE FROM outage_rollups')
+    for dimension in DIMENSIONS:
+        bucket = bucket_sql(dimension, 'o')
+        conn.execute(f'''INSERT INTO outage_rollups (dimension, bucket, n, n_timed, total_duration)
+                         SELECT '{dimension}', {bucket}, COUNT(*), COUNT({duration}), COALESCE(SUM({duration}), 0)
+                         FROM outages o
+                         GROUP BY {bucket}''')
+
+
+def _rollup(conn, dimension):
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"dimension must be one of {list(DIMENSIONS)}")
+    df = pd.read_sql_query('''SELECT bucket, n, n_timed, total_duration FROM outage_rollups
+                              WHERE dimension = ? ORDER BY bucket''', conn, params=(dimension,))
+    return df.set_index('bucket')
+
+
+def outage_counts(conn, dimension):
+    """Number of outages per bucket of `dimension` (a key of DIMENSIONS), as a Series."""
+    return _rollup(conn, dimension)['n'].rename('outages')
+
+
+def mean_durations(conn, dimension):
+    """Mean first-period duration in seconds per bucket, as a Series (NaN if no period)."""
+    df = _rollup(conn, dimension)
+    return (df['total_duration'] / df['n_timed'].where(df['n_timed'] > 0)).rename('mean_duration')
+
+
+def weekday_hour_counts(conn):
+    """Outage counts as a 7 x 24 DataFrame (rows: weekday, 0 = Monday; columns: hour)."""
+    counts = outage_counts(conn, 'weekday_hour').reindex(range(7 * 24), fill_value=0)
+    return pd.DataFrame(counts.to_numpy().reshape(7, 24), index=range(7), columns=range(24))
+
+
+def top_stops(conn, n=5):
+    """The n stops with the most outages, with their names: DataFrame of stop_id, name, outages."""
+    return pd.read_sql_query('''SELECT r.bucket AS stop_id, s.name, r.n AS outages
+                                FROM outage_rollups r LEFT JOIN stops s ON s.id = r.bucket
+                                WHERE r.dimension = 'stop'
+                                ORDER BY r.n DESC LIMIT ?''', conn, params=(n,))
+
+
+def outage_history(conn, outage_id):
+    """Every state an outage went through, oldest first: DataFrame of observed_at, status, updated_at, periods."""
+    df = pd.read_sql_query('''SELECT observed_at, status, updated_at, periods FROM outage_events
+                              WHERE outage_id = ? ORDER BY observed_at, id''', conn, params=(outage_id,))
+    df['observed_at'] = pd.to_datetime(df['observed_at'], unit='s', utc=True)
+    return df
+
+
+def outage_events_between(conn, start, end):
+    """Outage state changes observed with start <= observed_at < end (unix times), oldest first."""
+    df = pd.read_sql_query('''SELECT outage_id, observed_at, status, updated_at, periods FROM outage_events
+                              WHERE observed_at >= ? AND observed_at < ? ORDER BY observed_at, id''', conn, params=(start, end))
+    df['observed_at'] = pd.to_datetime(df['observed_at'], unit='s', utc=True)
+    return df
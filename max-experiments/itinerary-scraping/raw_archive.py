@@ -0,0 +1,143 @@
+import gzip
+import json
+import os
+import zipfile
+
+try:
+    import zstandard
+except ImportError:  # zstd segments are optional, gzip works out of the box
+    zstandard = None
+
+ARCHIVE_DIR = 'raw'
+INDEX_FILENAME = 'index.tsv'
+EXTENSIONS = {'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+
+
+def compress(data, codec):
+    if codec == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    return zstandard.ZstdCompressor(level=10).compress(data)
+
+
+def decompress(data, codec):
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def codec_of(segment):
+    for codec, extension in EXTENSIONS.items():
+        if segment.endswith(extension):
+            return codec
+    raise ValueError(f"Unknown archive segment type: {segment}")
+
+
+class RawArchive:
+    """
+    Append-only archive of raw itinerary responses.
+
+    Each response is stored as one JSON line {"time": ..., "raw": ...} (plus its
+    HTTP "status" when known, error responses are archived too) compressed
+    into its own gzip member / zstd frame, appended to the current segment file.
+    Concatenated members are still a valid .jsonl.gz / .jsonl.zst, so segments can
+    be read with standard tools. Segments rotate once they reach max_segment_bytes
+    or max_segment_age seconds, and every record gets a line in index.tsv:
+
+        time <tab> segment <tab> byte offset <tab> compressed length
+
+    which lets replay() seek straight to a timestamp range.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, codec='gzip', max_segment_bytes=64 * 1024 * 1024, max_segment_age=24 * 3600):
+        if codec not in EXTENSIONS:
+            raise ValueError(f"codec must be one of {list(EXTENSIONS)}")
+        if codec == 'zstd' and zstandard is None:
+            raise ImportError("zstd archives need the zstandard package")
+        self.directory = directory
+        self.codec = codec
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        os.makedirs(directory, exist_ok=True)
+        self.index = open(os.path.join(directory, INDEX_FILENAME), 'a', buffering=1)
+        self.segment = None
+        self.segment_file = None
+        self.segment_started = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def rotate(self, time_create):
+        if self.segment_file is not None:
+            self.segment_file.close()
+        self.segment = f"{time_create}{EXTENSIONS[self.codec]}"
+        self.segment_file = open(os.path.join(self.directory, self.segment), 'ab')
+        self.segment_started = time_create
+
+    def append(self, time_create, raw, status=None):
+        """Archive one raw response (the text as returned by the API), tagged with its HTTP status if given."""
+        if (self.segment_file is None
+                or self.segment_file.tell() >= self.max_segment_bytes
+                or time_create - self.segment_started >= self.max_segment_age):
+            self.rotate(time_create)
+
+        record = {'time': time_create, 'raw': raw}
+        if status is not None:
+            record['status'] = status
+        line = json.dumps(record) + '\n'
+        frame = compress(line.encode('utf-8'), self.codec)
+        offset = self.segment_file.tell()
+        self.segment_file.write(frame)
+        self.segment_file.flush()
+        # the index line is written after the frame, so it never points past the data
+        self.index.write(f"{time_create}\t{self.segment}\t{offset}\t{len(frame)}\n")
+
+    def close(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+        self.index.close()
+
+
+def read_index(directory=ARCHIVE_DIR):
+    """Yield (time, segment, offset, length) for every archived response, in write order."""
+    with open(os.path.join(directory, INDEX_FILENAME), 'r') as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) != 4:  # partially written last line after a crash
+                continue
+            yield int(parts[0]), parts[1], int(parts[2]), int(parts[3])
+
+
+def replay(directory=ARCHIVE_DIR, start=None, end=None):
+    """
+    Yield (time, raw_text) for archived responses with start <= time < end.
+
+    Only the frames listed in the index for that range are read and decompressed.
+    """
+    files = {}
+    try:
+        for time_create, segment, offset, length in read_index(directory):
+            if (start is not None and time_create < start) or (end is not None and time_create >= end):
+                continue
+            if segment not in files:
+                files[segment] = open(os.path.join(directory, segment), 'rb')
+            f = files[segment]
+            f.seek(offset)
+            record = json.loads(decompress(f.read(length), codec_of(segment)))
+            yield record['time'], record['raw']
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def replay_legacy_zip(zip_path='raw.zip', start=None, end=None):
+    """Yield (time, raw_text) from the old per-response raw.zip archive."""
+    with zipfile.ZipFile(zip_path, 'r') as zipf:
+        for name in zipf.namelist():
+            time_create = int(os.path.basename(name).split('_')[0])
+            if (start is not None and time_create < start) or (end is not None and time_create >= end):
+                continue
+            yield time_create, zipf.read(name).decode('utf-8')
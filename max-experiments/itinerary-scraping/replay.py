@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import time
+import zipfile
+from multiprocessing import Pool, cpu_count
+from itinerary import process_journey, extract_stops_data
+from journey_store import JourneyStore
+import raw_archive
+
+# per-process cache of open legacy zip files (re-reading the central directory is slow)
+_zip_files = {}
+
+
+def archive_locators(directory, start=None, end=None):
+    for time_create, segment, offset, length in raw_archive.read_index(directory):
+        if (start is not None and time_create < start) or (end is not None and time_create >= end):
+            continue
+        yield ('archive', time_create, directory, segment, offset, length)
+
+
+def legacy_zip_locators(zip_path, start=None, end=None):
+    with zipfile.ZipFile(zip_path, 'r') as zipf:
+        names = zipf.namelist()
+    for name in names:
+        time_create = int(os.path.basename(name).split('_')[0])
+        if (start is not None and time_create < start) or (end is not None and time_create >= end):
+            continue
+        yield ('zip', time_create, zip_path, name)
+
+
+def load_raw(locator):
+    """Raw response text, or None for an archived non-200 response (kept only for debugging)."""
+    if locator[0] == 'archive':
+        _, _, directory, segment, offset, length = locator
+        with open(os.path.join(directory, segment), 'rb') as f:
+            f.seek(offset)
+            frame = f.read(length)
+        record = json.loads(raw_archive.decompress(frame, raw_archive.codec_of(segment)))
+        return record['raw'] if record.get('status', 200) == 200 else None
+    _, _, zip_path, name = locator
+    if zip_path not in _zip_files:
+        _zip_files[zip_path] = zipfile.ZipFile(zip_path, 'r')
+    return _zip_files[zip_path].read(name).decode('utf-8')
+
+
+def parse_response(locator):
+    """
+    Worker: load one raw response and run the scraper's extraction functions on it.
+    Returns None for an unreadable, error or malformed response, which is skipped whole.
+    """
+    try:
+        raw = load_raw(locator)
+        if raw is None:
+            return None
+        itin = json.loads(raw)
+    except (ValueError, OSError, KeyError):
+        return None
+    if not isinstance(itin, dict) or 'message' in itin:
+        return None
+
+    journeys, stops, outages = [], [], []
+    try:
+        for journey in itin.get('journeys', []):
+            journeys.append(process_journey(journey))
+            journey_stops, journey_outages = extract_stops_data(journey)
+            stops.extend(journey_stops.values())
+            outages.extend(journey_outages.values())
+    except (KeyError, TypeError, AttributeError, IndexError):
+        return None
+    return locator[1], journeys, stops, outages
+
+
+def rebuild(db_filename, archive_dir=None, legacy_zip=None, start=None, end=None, processes=None, chunksize=64):
+    """
+    Rebuild a journeys database from the raw response archive.
+
+    Responses are parsed in a process pool, in archive order, and written through
+    JourneyStore in large batched transactions.
+    """
+    if os.path.exists(db_filename):
+        raise FileExistsError(f"{db_filename} already exists, replay only writes to a fresh database")
+
+    locators = []
+    if legacy_zip is not None:
+        locators.extend(legacy_zip_locators(legacy_zip, start, end))
+    if archive_dir is not None:
+        locators.extend(archive_locators(archive_dir, start, end))
+    print(f"Replaying {len(locators)} responses into {db_filename}")
+
+    n_responses = n_journeys = n_failed = 0
+    start_time = time.time()
+    with JourneyStore(db_filename, flush_interval=float('inf'), max_buffered=50000, use_bloom_filter=False) as store:
+        with Pool(processes or cpu_count()) as pool:
+            for result in pool.imap(parse_response, locators, chunksize=chunksize):
+                n_responses += 1
+                if result is None:
+                    n_failed += 1
+                    continue
+                time_create, journeys, stops, outages = result
+                for journey in journeys:
+                    store.add_journey(journey)
+                for stop in stops:
+                    store.add_stop(stop)
+                for outage in outages:
+                    store.add_outage(outage, time_create)
+                n_journeys += len(journeys)
+
+                if n_responses % 10000 == 0:
+                    elapsed = time.time() - start_time
+                    print(f"{n_responses}/{len(locators)} responses ({round(n_responses / elapsed)} responses/s, {round(n_journeys / elapsed)} journeys/s)")
+
+    elapsed = time.time() - start_time
+    print(f"Replayed {n_responses} responses ({n_failed} skipped) and {n_journeys} journeys in {round(elapsed, 1)}s "
+          f"({round(n_responses / max(elapsed, 1e-9))} responses/s, {round(n_journeys / max(elapsed, 1e-9))} journeys/s)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild journeys.db from the raw response archive')
+    parser.add_argument('db', help='path of the fresh database to create')
+    parser.add_argument('--archive', default=None, help='RawArchive directory (e.g. raw)')
+    parser.add_argument('--legacy-zip', default=None, help='old raw.zip archive')
+    parser.add_argument('--start', type=int, default=None, help='first unix timestamp to replay')
+    parser.add_argument('--end', type=int, default=None, help='replay up to this unix timestamp (exclusive)')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+    if args.archive is None and args.legacy_zip is None:
+        parser.error('give --archive and/or --legacy-zip')
+    rebuild(args.db, archive_dir=args.archive, legacy_zip=args.legacy_zip, start=args.start, end=args.end, processes=args.processes)
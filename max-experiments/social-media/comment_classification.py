@@ -1,82 +1,319 @@
+import argparse
 import csv
+import random
+import time
 import torch
-from transformers import pipeline, DistilBertTokenizer, AutoTokenizer, AutoModelForSequenceClassification
+from torch.utils.data import DataLoader
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from keyword_matcher import KeywordMatcher, is_whole_word
+
+SENTIMENT_MODEL = "distilbert-base-uncased-finetuned-sst-2-english"
+TOPIC_MODEL = "facebook/bart-large-mnli"
+# distilled NLI model (DistilBERT, ~6x fewer FLOPs than BART large) for the first topic pass
+FAST_TOPIC_MODEL = "typeform/distilbert-base-uncased-mnli"
+
+# Tell if it is about public transit or not
+TOPIC_LABELS = ["this comment makes a statement on the quality of a public transit system", "this comment does not make statements about the quality of the public transit system mentioned", "this comment is not about transit or only briefly mentions transit"]
+# what the zero-shot-classification pipeline wraps each label in
+HYPOTHESIS_TEMPLATE = "This example is {}."
+
+# Cascade gates. The final gates are the ones applied to the BART scores. By
+# default the fast model only rejects comments it finds clearly off-topic, with
+# loose gates, and everything else goes through the BART gates. Setting
+# accept_transit also lets it accept comments it finds clearly on-topic, which
+# then skip BART. Check the fast gates against BART with --audit-fraction (see
+# topic_gates()) before tightening them.
+THRESHOLDS = {
+    'min_keyword_density': 0.01,    # transit keywords per word of the body: 1 in a 100-word comment, 2 in 200
+    'max_not_transit': 0.2,         # final gates
+    'min_transit': 0.7,
+    'reject_not_transit': 0.9,      # fast model: reject above / below these
+    'reject_transit': 0.05,
+    'accept_not_transit': 0.05,     # fast model: accept when both hold, off unless accept_transit is set
+    'accept_transit': None,
+}
+
+FIELDNAMES = ['link_id', 'subreddit', 'ups', 'downs', 'num_keywords', 'location', 'sentiment_label', 'sentiment_score', 'about_other_prob', 'about_transit_prob', 'topic_stage', 'body']
+
+def get_keywords(keywords_file='transit_keywords.txt'):
+    """Transit keywords, without the spaces padding them in the file (matched as whole words instead)."""
+    with open(keywords_file, 'r') as f:
+        keywords = [keyword.strip() for keyword in f.read().splitlines()]
+    return [keyword for keyword in keywords if keyword]
 
 def get_locations(keywords_file='transit_system_keywords.txt'):
     with open(keywords_file, 'r') as f:
         keywords = f.read().splitlines()
     return keywords
 
-def classify_comments(input_filename, output_filename):
-    device = torch.device("mps") if torch.has_mps else torch.device("cpu")
-    print(f"Using {device} for PyTorch")
-    model_name = "distilbert-base-uncased-finetuned-sst-2-english"
-    sentiment_pipeline = pipeline("sentiment-analysis", model=model_name, device=device)
-    topic_classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli", device=device)
-    tokenizer = DistilBertTokenizer.from_pretrained(model_name)
-    locations = get_locations()
-    
-    with open(input_filename, 'r') as infile:
-        reader = csv.DictReader(infile)
-        total_comments = sum(1 for row in reader)
-        print(f"Got {total_comments} comments")
-        infile.seek(0)  # Reset reader to the beginning of the file
+def get_device():
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    if torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+def bucketed_batches(lengths, batch_size, bucket_size):
+    """
+    Batches of indices whose token lengths are close: indices are taken in
+    windows of bucket_size, sorted by length inside each window and cut into
+    batches, so padding stays small without reordering the whole input.
+    """
+    batches = []
+    for start in range(0, len(lengths), bucket_size):
+        window = sorted(range(start, min(start + bucket_size, len(lengths))), key=lambda i: -lengths[i])
+        batches.extend(window[i:i + batch_size] for i in range(0, len(window), batch_size))
+    return batches
+
+def run_batches(model, items, lengths, collate, batch_size, bucket_size, device):
+    """Logits of `model` for every item, in item order, batched by bucketed_batches()."""
+    batches = bucketed_batches(lengths, batch_size, bucket_size)
+    loader = DataLoader(items, batch_sampler=batches, collate_fn=collate)
+    logits = [None] * len(items)
+    with torch.inference_mode():
+        for indices, batch in zip(batches, loader):
+            output = model(**{key: value.to(device) for key, value in batch.items()}).logits.float().cpu()
+            for index, row in zip(indices, output.reshape(len(indices), -1, output.shape[-1])):
+                logits[index] = row
+    return torch.stack(logits) if logits else torch.empty(0)
+
+class ZeroShotModel:
+    """
+    An NLI model used for zero-shot classification: the entailment of one
+    hypothesis per label is scored, like the zero-shot-classification pipeline,
+    with all labels of a batch in one forward pass.
+    """
+
+    def __init__(self, model_name, device):
+        self.device = device
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name).to(device).eval()
+        self.entailment_id = next(i for label, i in self.model.config.label2id.items()
+                                  if label.lower().startswith('entail'))
+
+    def scores(self, bodies, labels, batch_size, bucket_size):
+        """(n, len(labels)) tensor of label probabilities, summing to 1 for each text."""
+        hypotheses = [HYPOTHESIS_TEMPLATE.format(label) for label in labels]
+        encodings = self.tokenizer([body for body in bodies for _ in hypotheses], hypotheses * len(bodies),
+                                   truncation='only_first')
+        n_labels = len(hypotheses)
+        items = [[{key: encodings[key][i * n_labels + k] for key in encodings} for k in range(n_labels)]
+                 for i in range(len(bodies))]
+        lengths = [len(item[0]['input_ids']) for item in items]
+        collate = lambda batch: self.tokenizer.pad([pair for item in batch for pair in item], return_tensors='pt')
+        logits = run_batches(self.model, items, lengths, collate, batch_size, bucket_size, self.device)
+        if len(logits) == 0:
+            return torch.empty(0, n_labels)
+        return logits[:, :, self.entailment_id].softmax(dim=-1)
+
+class CommentClassifier:
+    """
+    Sentiment (DistilBERT SST-2) and transit topic (BART MNLI zero-shot) of
+    comments, in padded batches of similar lengths. With a fast_topic_model
+    (a distilled NLI model) topics can first be estimated cheaply, see
+    classify_comments().
+
+    Each model tokenizes the texts it scores up front, truncated to its maximum
+    input length: the sentiment model once per text, an NLI model once per
+    (text, label hypothesis) pair, i.e. len(TOPIC_LABELS) times per text.
+    """
+
+    def __init__(self, device=None, batch_size=16, bucket_size=None, max_length=500, fast_topic_model=FAST_TOPIC_MODEL):
+        self.device = device or get_device()
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size or batch_size * 32
+        self.max_length = max_length
+
+        self.sentiment_tokenizer = AutoTokenizer.from_pretrained(SENTIMENT_MODEL)
+        self.sentiment_model = AutoModelForSequenceClassification.from_pretrained(SENTIMENT_MODEL).to(self.device).eval()
+        self.topic_model = ZeroShotModel(TOPIC_MODEL, self.device)
+        self.fast_topic_model = ZeroShotModel(fast_topic_model, self.device) if fast_topic_model else None
+
+    def topics(self, bodies):
+        """(n, len(TOPIC_LABELS)) tensor of label probabilities from the full BART MNLI model."""
+        return self.topic_model.scores(bodies, TOPIC_LABELS, self.batch_size, self.bucket_size)
 
-        with open(output_filename, 'w', newline='') as csvfile:
-            reader = csv.DictReader(infile)
-            fieldnames = ['link_id', 'subreddit', 'ups', 'downs', 'num_keywords', 'location', 'sentiment_label', 'sentiment_score', 'about_other_prob', 'about_transit_prob', 'body']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
+    def fast_topics(self, bodies):
+        """Same as topics(), from the distilled model."""
+        return self.fast_topic_model.scores(bodies, TOPIC_LABELS, self.batch_size, self.bucket_size)
 
-            done_comments = 0
+    def sentiments(self, bodies):
+        """(label, score) of every comment, label being POSITIVE or NEGATIVE."""
+        encodings = self.sentiment_tokenizer(list(bodies), truncation=True, max_length=self.max_length)
+        items = [{key: encodings[key][i] for key in encodings} for i in range(len(bodies))]
+        lengths = [len(item['input_ids']) for item in items]
+        collate = lambda batch: self.sentiment_tokenizer.pad(batch, return_tensors='pt')
+        logits = run_batches(self.sentiment_model, items, lengths, collate, self.batch_size, self.bucket_size, self.device)
+        if len(logits) == 0:
+            return []
+        scores, labels = logits[:, 0].softmax(dim=-1).max(dim=-1)
+        id2label = self.sentiment_model.config.id2label
+        return [(id2label[int(label)], float(score)) for label, score in zip(labels, scores)]
 
-            for row in reader:
-                done_comments += 1
+def read_windows(reader, size):
+    window = []
+    for row in reader:
+        window.append(row)
+        if len(window) == size:
+            yield window
+            window = []
+    if window:
+        yield window
 
-                if done_comments % 5 == 0:
-                    print(f"{round(done_comments / total_comments * 100, 2)}% done..")
+def bart_keeps(scores, thresholds):
+    """The final gates: whether BART topic scores make a comment about the quality of a transit system."""
+    return scores[2] <= thresholds['max_not_transit'] and scores[0] >= thresholds['min_transit']
 
+def topic_gates(classifier, rows, thresholds, counts, audit_fraction=0.0, rng=random):
+    """
+    Rows about the quality of a transit system, with their topic probabilities.
+    The distilled model decides the clear cases and BART the ambiguous rest;
+    topic_stage records which one ('fast' or 'nli') the probabilities come from.
+
+    audit_fraction of the rows the fast model decides are also scored by BART,
+    without changing the outcome, and counted in counts['audited'] and
+    counts['disagreed'] when BART would have decided otherwise: the cascade's
+    disagreement with a BART-only run (--fast-model none) on those rows.
+    """
+    def set_scores(row, scores, stage):
+        row['about_transit_prob'] = scores[0]
+        row['about_other_prob'] = scores[1]
+        row['topic_stage'] = stage
+
+    kept = []
+    ambiguous = rows
+    audited = []  # (row, fast model kept it)
+    if classifier.fast_topic_model is not None and rows:
+        ambiguous = []
+        accept_transit = thresholds['accept_transit']
+        for row, scores in zip(rows, classifier.fast_topics([row['body'] for row in rows]).tolist()):
+            if scores[2] > thresholds['reject_not_transit'] or scores[0] < thresholds['reject_transit']:
+                counts['fast_rejected'] += 1
+                decided = False
+            elif accept_transit is not None and scores[0] > accept_transit and scores[2] < thresholds['accept_not_transit']:
+                counts['fast_accepted'] += 1
+                set_scores(row, scores, 'fast')
+                kept.append(row)
+                decided = True
+            else:
+                ambiguous.append(row)
+                continue
+            if audit_fraction and rng.random() < audit_fraction:
+                audited.append((row, decided))
+
+    counts['nli'] += len(ambiguous)
+    for row, scores in zip(ambiguous, classifier.topics([row['body'] for row in ambiguous]).tolist()):
+        if bart_keeps(scores, thresholds):
+            set_scores(row, scores, 'nli')
+            kept.append(row)
+
+    if audited:
+        counts['audited'] += len(audited)
+        for (row, decided), scores in zip(audited, classifier.topics([row['body'] for row, _ in audited]).tolist()):
+            counts['disagreed'] += bart_keeps(scores, thresholds) != decided
+    kept_ids = {id(row) for row in kept}
+    return [row for row in rows if id(row) in kept_ids]
+
+def report(counts, elapsed):
+    """Pass-through of every stage of the cascade, relative to the comments read."""
+    read = max(counts['read'], 1)
+    stages = [('location', 'located'), ('keyword density', 'dense'), ('fast model accepted', 'fast_accepted'),
+              ('fast model rejected', 'fast_rejected'), ('BART MNLI', 'nli'), ('kept', 'kept')]
+    print(f"{counts['read']} comments in {round(elapsed, 1)}s ({round(counts['read'] / max(elapsed, 1e-9), 1)} comments/s): "
+          + ', '.join(f"{name} {counts[key]} ({round(counts[key] / read * 100, 1)}%)" for name, key in stages))
+    if counts['audited']:
+        print(f"audit: BART agrees with {counts['audited'] - counts['disagreed']} of {counts['audited']} fast model decisions "
+              f"({round((1 - counts['disagreed'] / counts['audited']) * 100, 1)}%)")
+
+def classify_comments(input_filename, output_filename, batch_size=16, window_size=1024, threads=None, device=None,
+                      thresholds=None, fast_topic_model=FAST_TOPIC_MODEL, audit_fraction=0.0, seed=0):
+    """
+    Keep the comments of input_filename that judge the quality of a transit
+    system, with their sentiment, streaming to output_filename.
+
+    A cascade, cheapest stage first, each stage only seeing what the previous
+    one let through:
+
+        1. location: a location from transit_system_keywords.txt is named
+        2. keyword density: enough transit keywords per word of the body
+        3. distilled NLI model: confident rejects (and accepts, if enabled) are final
+        4. BART MNLI zero-shot: decides the ambiguous rest
+        5. sentiment, only for the comments kept
+
+    Gates are THRESHOLDS, updated with `thresholds`; fast_topic_model=None skips
+    stage 3. Rows are read window_size at a time, models run in batches.
+    audit_fraction of the stage 3 decisions are checked against BART and the
+    agreement is reported (see topic_gates()); seed makes the sample repeatable.
+    """
+    thresholds = dict(THRESHOLDS, **(thresholds or {}))
+    if threads:
+        torch.set_num_threads(threads)
+    classifier = CommentClassifier(device=device, batch_size=batch_size, fast_topic_model=fast_topic_model)
+    print(f"Using {classifier.device} for PyTorch ({torch.get_num_threads()} threads)")
+    locations = get_locations()
+    location_rank = {location.lower(): rank for rank, location in enumerate(locations) if location}
+    matcher = KeywordMatcher({'location': locations, 'keyword': get_keywords()})
+
+    start_time = time.time()
+    counts = dict.fromkeys(['read', 'located', 'dense', 'fast_accepted', 'fast_rejected', 'nli', 'kept', 'audited', 'disagreed'], 0)
+    rng = random.Random(seed)
+    with open(input_filename, 'r') as infile, open(output_filename, 'w', newline='') as csvfile:
+        reader = csv.DictReader(infile)
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+        writer.writeheader()
+
+        for rows in read_windows(reader, window_size):
+            counts['read'] += len(rows)
+
+            # stages 1 and 2 in one pass over the body, first location in transit_system_keywords.txt order
+            candidates = []
+            for row in rows:
                 body = row['body']
-                
-                body_lower = str(row).lower()
-                
-                if not any(location in body_lower for location in locations):
-                    continue
-                
-                location_comment = None
-                for location in locations:
-                    if location in body_lower:
-                        location_comment = location
-                        break
-
-                tokens = tokenizer.encode(body, add_special_tokens=True, truncation=True, max_length=500)
-
-                truncated_body = tokenizer.decode(tokens, clean_up_tokenization_spaces=True)
-
-                sentiment_result = sentiment_pipeline(truncated_body)[0]
-                row['sentiment_label'] = sentiment_result['label']
-                row['sentiment_score'] = sentiment_result['score']
-
-                # Tell if it is about public transit or not
-                labels = ["this comment makes a statement on the quality of a public transit system", "this comment does not make statements about the quality of the public transit system mentioned", "this comment is not about transit or only briefly mentions transit"]
-                result_classify = topic_classifier(body, labels)
-                scores = result_classify['scores']
-
-                row['about_transit_prob'] = float(scores[0])
-                row['about_other_prob'] = float(scores[1])
-                about_not_transit = float(scores[2])
-                
-                row['location'] = location_comment
-                
-                if about_not_transit > 0.2:
+                matches = matcher.find(body)
+                found = {word for _, word, groups in matches + matcher.find(row.get('subreddit', '')) if 'location' in groups}
+                if not found:
                     continue
-                
-                if row['about_transit_prob'] < 0.7:
+                counts['located'] += 1
+                # match positions are in the lowercased body, which can be longer than the body
+                lowered = body.lower()
+                n_keywords = sum(1 for start, word, groups in matches
+                                 if 'keyword' in groups and is_whole_word(lowered, start, len(word)))
+                if n_keywords < thresholds['min_keyword_density'] * max(len(body.split()), 1):
                     continue
+                counts['dense'] += 1
+                row['location'] = min(found, key=location_rank.get)
+                candidates.append(row)
+
+            kept = topic_gates(classifier, candidates, thresholds, counts, audit_fraction, rng)
+
+            for row, (label, score) in zip(kept, classifier.sentiments([row['body'] for row in kept])):
+                row['sentiment_label'] = label
+                row['sentiment_score'] = score
+            writer.writerows(kept)
+            csvfile.flush()
+            counts['kept'] += len(kept)
+            report(counts, time.time() - start_time)
 
-                writer.writerow(row)
+    report(counts, time.time() - start_time)
 
 if __name__ == '__main__':
-    input_filename = 'out/reddit_comments_2022_01_keywords.csv'  # Replace with your input file name
-    output_filename = 'out/reddit_top_10m_reddit_comments_2022_01_classified.csv'  # Replace with your desired output file name
-    classify_comments(input_filename, output_filename)
+    parser = argparse.ArgumentParser(description='Classify transit comments by topic and sentiment')
+    parser.add_argument('input', nargs='?', default='out/reddit_comments_2022_01_keywords.csv')
+    parser.add_argument('output', nargs='?', default='out/reddit_top_10m_reddit_comments_2022_01_classified.csv')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--window-size', type=int, default=1024, help='rows read and classified at a time')
+    parser.add_argument('--threads', type=int, default=None, help='PyTorch CPU threads')
+    parser.add_argument('--fast-model', default=FAST_TOPIC_MODEL, help="distilled NLI model of the first topic pass, 'none' to only use BART")
+    for name, value in THRESHOLDS.items():
+        if name != 'accept_transit':
+            parser.add_argument('--' + name.replace('_', '-'), type=float, default=value)
+    parser.add_argument('--accept-transit', type=lambda value: None if value == 'none' else float(value),
+                        default=THRESHOLDS['accept_transit'],
+                        help="fast model: accept above this, 'none' (default) to confirm every comment with BART")
+    parser.add_argument('--audit-fraction', type=float, default=0.0,
+                        help='fraction of the fast model decisions also scored by BART to report their agreement')
+    args = parser.parse_args()
+    thresholds = {name: getattr(args, name) for name in THRESHOLDS}
+    classify_comments(args.input, args.output, batch_size=args.batch_size, window_size=args.window_size, threads=args.threads,
+                      thresholds=thresholds, fast_topic_model=None if args.fast_model == 'none' else args.fast_model,
+                      audit_fraction=args.audit_fraction)
@@ -0,0 +1,104 @@
+from collections import Counter, deque
+
+try:
+    import ahocorasick
+except ImportError:  # pure-Python automaton below, same results, slower
+    ahocorasick = None
+
+
+def is_whole_word(text, start, length):
+    """Whether text[start:start + length] is neither preceded nor followed by a letter or digit."""
+    end = start + length
+    return not (start > 0 and text[start - 1].isalnum()) and not (end < len(text) and text[end].isalnum())
+
+
+class _Automaton:
+    """Minimal Aho-Corasick automaton, used when pyahocorasick is not installed."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+    def add_word(self, word, value):
+        state = 0
+        for char in word:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append(value)
+
+    def make_automaton(self):
+        # breadth-first, so the failure state of a node is always finished before the node
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def iter(self, text):
+        state = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for end, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for value in output[state]:
+                yield end, value
+
+
+class KeywordMatcher:
+    """
+    Every occurrence of a set of keywords in one linear pass over the text,
+    whatever the number of keywords (Aho-Corasick). Matching is case-insensitive
+    and overlapping occurrences are all reported.
+
+    Build once (e.g. per worker process) and reuse for every text. Keywords can
+    be put in groups, e.g. {'keyword': [...], 'location': [...]}.
+    """
+
+    def __init__(self, groups):
+        self.automaton = ahocorasick.Automaton() if ahocorasick is not None else _Automaton()
+        words = {}
+        for group, keywords in groups.items():
+            for keyword in keywords:
+                if keyword:
+                    words.setdefault(keyword.lower(), []).append(group)
+        for word, word_groups in words.items():
+            self.automaton.add_word(word, (word, tuple(word_groups)))
+        self.empty = not words
+        if not self.empty:
+            self.automaton.make_automaton()
+
+    def find(self, text, whole_words=False):
+        """
+        (start position, keyword, groups) of every occurrence in text, by end position.
+        With whole_words, only occurrences not preceded or followed by a letter or digit.
+        """
+        if self.empty:
+            return []
+        text = text.lower()
+        matches = [(end - len(word) + 1, word, groups) for end, (word, groups) in self.automaton.iter(text)]
+        if whole_words:
+            matches = [match for match in matches if is_whole_word(text, match[0], len(match[1]))]
+        return matches
+
+    def contains(self, text):
+        """Whether any keyword occurs in text, stopping at the first occurrence."""
+        return not self.empty and next(iter(self.automaton.iter(text.lower())), None) is not None
+
+    def counts(self, text):
+        """Number of occurrences of each keyword found in text, per group: {group: Counter}."""
+        counts = {}
+        for _, word, groups in self.find(text):
+            for group in groups:
+                counts.setdefault(group, Counter())[word] += 1
+        return counts
@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Pool, cpu_count
+from pushshift_to_csv import CsvSink, filter_dump, get_keywords, get_locations, init_worker
+
+CHECKPOINT_DIR = 'out/checkpoints'
+
+def month_range(start, end):
+    """'YYYY-MM' strings from start to end, both included."""
+    year, month = map(int, start.split('-'))
+    months = []
+    while f'{year:04d}-{month:02d}' <= end:
+        months.append(f'{year:04d}-{month:02d}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+def input_path(input_dir, month):
+    """The month's dump, compressed (RC_YYYY-MM.zst) or not, or None if there is neither."""
+    for name in (f'RC_{month}.zst', f'RC_{month}'):
+        path = os.path.join(input_dir, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_checkpoint(path, checkpoint):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+def run_month(month, input_dir='.', output_dir='out', checkpoint_dir=CHECKPOINT_DIR, processes=None,
+              max_comments=None, checkpoint_interval=60):
+    """
+    Filter one month's dump to out/reddit_comments_YYYY_MM_keywords.csv, resuming
+    from its checkpoint if there is one.
+
+    The checkpoint records how far the input has been read (uncompressed bytes, at
+    a shard boundary) and the size and row count of the output at that point. It
+    is written every checkpoint_interval seconds and when the month is done. On
+    resume the output is cut back to the checkpointed size and the input is read
+    from the checkpointed offset, so no comment is lost or written twice.
+    """
+    path = input_path(input_dir, month)
+    if path is None:
+        print(f"{month}: no RC_{month}[.zst] in {input_dir}, skipped")
+        return month, None
+
+    year, mm = month.split('-')
+    output_filename = os.path.join(output_dir, f'reddit_comments_{year}_{mm}_keywords.csv')
+    checkpoint_path = os.path.join(checkpoint_dir, f'reddit_comments_{year}_{mm}.json')
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint is not None and not os.path.exists(output_filename):
+        print(f"{month}: {output_filename} is missing, starting over")
+        checkpoint = None
+    if checkpoint is not None and checkpoint['done']:
+        print(f"{month}: already done ({checkpoint['rows']} comments)")
+        return month, checkpoint['rows']
+    if checkpoint is not None:
+        sink = CsvSink(output_filename, truncate_to=checkpoint['output_bytes'])
+        print(f"{month}: resuming at byte {checkpoint['offset']} of {path} ({checkpoint['rows']} comments so far)")
+    else:
+        sink = CsvSink(output_filename)
+        checkpoint = {'input': path, 'offset': 0, 'rows': 0, 'lines': 0, 'output_bytes': sink.tell(), 'done': False}
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    start_time = last_checkpoint = time.time()
+    try:
+        with Pool(processes or cpu_count(), initializer=init_worker, initargs=(get_keywords(), get_locations())) as pool:
+            for offset, num_lines, records in filter_dump(path, pool, checkpoint['offset']):
+                if max_comments is not None:
+                    records = records[:max(0, max_comments - checkpoint['rows'])]
+                sink.write(records)
+                checkpoint.update(offset=offset, rows=checkpoint['rows'] + len(records),
+                                  lines=checkpoint['lines'] + num_lines)
+
+                capped = max_comments is not None and checkpoint['rows'] >= max_comments
+                if capped or time.time() - last_checkpoint >= checkpoint_interval:
+                    save_checkpoint(checkpoint_path, dict(checkpoint, output_bytes=sink.tell()))
+                    last_checkpoint = time.time()
+                    print(f"{month}: {checkpoint['rows']} comments, {checkpoint['lines']} lines read")
+                if capped:
+                    break
+        checkpoint.update(output_bytes=sink.tell(), done=True)
+        save_checkpoint(checkpoint_path, checkpoint)
+    finally:
+        sink.close()
+
+    print(f"{month}: saved {checkpoint['rows']} comments in {round(time.time() - start_time, 1)}s")
+    return month, checkpoint['rows']
+
+def run_months(months, jobs=1, processes=None, **kwargs):
+    """
+    Run several months, `jobs` of them at the same time, sharing a budget of
+    `processes` worker processes (all CPUs by default) between them.
+    """
+    budget = processes or cpu_count()
+    jobs = max(1, min(jobs, len(months), budget))
+    if jobs == 1:
+        return [run_month(month, processes=budget, **kwargs) for month in months]
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [executor.submit(run_month, month, processes=budget // jobs, **kwargs) for month in months]
+        return [future.result() for future in futures]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Filter a range of monthly Pushshift comment dumps, with resumable checkpoints')
+    parser.add_argument('start', help='first month, YYYY-MM')
+    parser.add_argument('end', nargs='?', default=None, help='last month, YYYY-MM (default: start)')
+    parser.add_argument('--input-dir', default='.', help='directory of the RC_YYYY-MM[.zst] dumps')
+    parser.add_argument('--out', default='out')
+    parser.add_argument('--checkpoints', default=CHECKPOINT_DIR)
+    parser.add_argument('--jobs', type=int, default=1, help='months processed at the same time')
+    parser.add_argument('--processes', type=int, default=None, help='total worker processes (default: all CPUs)')
+    parser.add_argument('--max-comments', type=int, default=None, help='stop a month after this many comments')
+    parser.add_argument('--checkpoint-interval', type=float, default=60, help='seconds between checkpoints')
+    args = parser.parse_args()
+    run_months(month_range(args.start, args.end or args.start), jobs=args.jobs, processes=args.processes,
+               input_dir=args.input_dir, output_dir=args.out, checkpoint_dir=args.checkpoints,
+               max_comments=args.max_comments, checkpoint_interval=args.checkpoint_interval)
@@ -1,6 +1,8 @@
 import json
 import csv
+import os
 from multiprocessing import Pool, cpu_count
+from keyword_matcher import KeywordMatcher
 
 def get_keywords(keywords_file='transit_keywords.txt'):
     with open(keywords_file, 'r') as f:
@@ -12,61 +14,213 @@ def get_locations(keywords_file='transit_system_keywords.txt'):
         keywords = f.read().splitlines()
     return keywords
 
-def process_line(line, keywords, locations=['lyon', 'paris', 'tokyo', 'boston', 'seattle', 'london', 'new york', 'nyc', 'berlin', 'prague']):
-    line_lower = line.lower()
-    if any(keyword.lower() in line_lower for keyword in keywords):
-        try:
-            entry = json.loads(line)
-            num_keywords = sum(1 for keyword in keywords if keyword in line_lower)
-            return {
-                'link_id': entry.get('link_id', ''),
-                'subreddit': entry.get('subreddit', ''),
-                'ups': entry.get('ups', 0),
-                'downs': entry.get('downs', 0),
-                'body': entry.get('body', ''),
-            }
-        except json.JSONDecodeError:
-            return None
-    return None
-
-def worker(line_and_keywords):
-    line, keywords = line_and_keywords
-    return process_line(line, keywords)
-
-def export_to_csv(input_filename, output_filename):
+def build_matchers(keywords, locations):
+    """
+    Body matcher for transit keywords and locations, plus a prefilter over raw
+    lines that also knows the JSON-escaped form of non-ASCII keywords ('l\\u00e9ger').
+    A line the prefilter rejects cannot have a keyword in its body, so most
+    lines are never parsed.
+    """
+    matcher = KeywordMatcher({'keyword': keywords, 'location': locations})
+    line_filter = KeywordMatcher({'keyword': keywords + [json.dumps(keyword.lower())[1:-1] for keyword in keywords]})
+    return matcher, line_filter
+
+def process_line(line, matcher, line_filter=None):
+    if line_filter is not None and not line_filter.contains(line):
+        return None
+    try:
+        entry = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    body = entry.get('body') or ''
+    # one pass over the body for both keywords and locations
+    matches = matcher.find(body)
+    num_keywords = sum(1 for _, _, groups in matches if 'keyword' in groups)
+    if num_keywords == 0:
+        return None
+    locations = [word for _, word, groups in matches if 'location' in groups]
+    return {
+        'link_id': entry.get('link_id', ''),
+        'subreddit': entry.get('subreddit', ''),
+        'ups': entry.get('ups', 0),
+        'downs': entry.get('downs', 0),
+        'num_keywords': num_keywords,
+        'location': locations[0] if locations else '',
+        'body': body,
+    }
+
+# automata built once per worker process by init_worker()
+_matcher = None
+_line_filter = None
+
+FIELDNAMES = ['link_id', 'subreddit', 'ups', 'downs', 'num_keywords', 'location', 'body']
+
+# uncompressed bytes handed to a worker at a time
+SHARD_SIZE = 1 << 25
+
+def init_worker(keywords, locations):
+    global _matcher, _line_filter
+    _matcher, _line_filter = build_matchers(keywords, locations)
+
+def process_lines(n_bytes, lines):
+    """(n_bytes, number of lines seen, matched records among `lines`)."""
+    records = []
+    for line in lines:
+        result = process_line(line, _matcher, _line_filter)
+        if result:
+            records.append(result)
+    return n_bytes, len(lines), records
+
+def process_range(shard):
+    """
+    Worker: the lines of a plain dump starting in the byte range [start, end).
+    The range is read by the worker itself, only matched records go back.
+    """
+    filename, start, end = shard
+    lines = []
+    with open(filename, 'rb') as f:
+        if start > 0:
+            # skip the line already handled by the previous shard
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            lines.append(line.decode('utf-8', errors='replace'))
+    return process_lines(end - start, lines)
+
+def process_chunk(chunk):
+    """Worker: a block of complete lines of decompressed dump."""
+    return process_lines(len(chunk), chunk.decode('utf-8', errors='replace').splitlines())
+
+def byte_ranges(filename, shard_size=SHARD_SIZE, offset=0):
+    size = os.path.getsize(filename)
+    return [(filename, start, min(start + shard_size, size)) for start in range(offset, size, shard_size)]
+
+def zst_chunks(filename, chunk_size=SHARD_SIZE, offset=0):
+    """
+    Stream-decompress a Pushshift .zst dump into blocks of complete lines, without
+    writing the decompressed file. A zstd stream cannot be entered at an arbitrary
+    offset, so decompression stays in this process and only parsing is sharded.
+
+    `offset` (in decompressed bytes, at a line boundary) skips the start of the dump.
+    """
+    import zstandard
+    with open(filename, 'rb') as fh:
+        # the dumps are compressed with a long window
+        reader = zstandard.ZstdDecompressor(max_window_size=2 ** 31).stream_reader(fh)
+        if offset:
+            reader.seek(offset)
+        rest = b''
+        while True:
+            data = reader.read(chunk_size)
+            if not data:
+                break
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            if cut == 0:
+                rest = data
+                continue
+            yield data[:cut]
+            rest = data[cut:]
+        if rest:
+            yield rest
+
+class CsvSink:
+    def __init__(self, filename, truncate_to=None):
+        if truncate_to is None:
+            self.file = open(filename, 'w', newline='')
+        else:
+            # resume: drop whatever was written after the last checkpoint
+            self.file = open(filename, 'r+', newline='')
+            self.file.truncate(truncate_to)
+            self.file.seek(truncate_to)
+        self.writer = csv.DictWriter(self.file, fieldnames=FIELDNAMES)
+        if truncate_to is None:
+            self.writer.writeheader()
+
+    def write(self, records):
+        self.writer.writerows(records)
+
+    def tell(self):
+        """Size of the output so far, once everything written is on disk."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+class ParquetSink:
+    def __init__(self, filename):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([('link_id', pa.string()), ('subreddit', pa.string()), ('ups', pa.int64()),
+                                 ('downs', pa.int64()), ('num_keywords', pa.int64()), ('location', pa.string()),
+                                 ('body', pa.string())])
+        self.writer = pq.ParquetWriter(filename, self.schema)
+
+    def write(self, records):
+        if records:
+            self.writer.write_table(self.pa.Table.from_pylist(records, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+def filter_dump(input_filename, pool, offset=0, shard_size=SHARD_SIZE):
+    """
+    Run a dump through the keyword filter on a pool set up with init_worker.
+
+    Plain dumps are split into byte ranges that workers read themselves, .zst dumps
+    are decompressed on the fly and handed out in blocks of lines. Workers return
+    only the matched records of a whole shard.
+
+    Yields (offset, number of lines, matched records) per shard, in input order,
+    `offset` being the uncompressed position up to which the input is done.
+    """
+    if input_filename.endswith('.zst'):
+        shards, process_shard = zst_chunks(input_filename, shard_size, offset), process_chunk
+    else:
+        shards, process_shard = byte_ranges(input_filename, shard_size, offset), process_range
+    for n_bytes, num_lines, records in pool.imap(process_shard, shards):
+        offset += n_bytes
+        yield offset, num_lines, records
+
+def export_to_csv(input_filename, output_filename, max_comments=100000, processes=None):
+    """
+    Filter a Pushshift comment dump (plain RC_YYYY-MM or compressed RC_YYYY-MM.zst)
+    down to the comments mentioning transit, written as CSV, or Parquet when
+    output_filename ends in .parquet. pushshift_batch.py runs several months
+    with resumable checkpoints.
+    """
     keywords = get_keywords()
     locations = get_locations()
-    max_comments = 100000
 
     num_comments_processed = 0
     num_keyword_comments = 0
 
-    with open(input_filename, 'r') as infile, open(output_filename, 'w', newline='') as csvfile:
-        fieldnames = ['link_id', 'subreddit', 'ups', 'downs', 'body']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-
-        with Pool(cpu_count()) as pool:
-            for result in pool.imap(worker, ((line, keywords) for line in infile), chunksize=5000):
-                num_comments_processed += 1
+    sink = ParquetSink(output_filename) if output_filename.endswith('.parquet') else CsvSink(output_filename)
+    try:
+        with Pool(processes or cpu_count(), initializer=init_worker, initargs=(keywords, locations)) as pool:
+            for _, num_lines, records in filter_dump(input_filename, pool):
+                num_comments_processed += num_lines
+                records = records[:max_comments - num_keyword_comments]
+                sink.write(records)
+                num_keyword_comments += len(records)
+                print(f"{round(num_keyword_comments / max_comments * 100, 1)}% Complete.. ({num_keyword_comments} comments, {num_comments_processed} lines read)")
 
-                if num_comments_processed % 50000 == 0:
-                    print(f"{round(num_keyword_comments / max_comments * 100, 1)}% Complete.. ({num_keyword_comments} comments)")
-
-                if num_keyword_comments > max_comments:
+                if num_keyword_comments >= max_comments:
                     break
-
-                if result:
-                    
-                    writer.writerow(result)
-                    num_keyword_comments += 1
+    finally:
+        sink.close()
 
     print(f"Saved {num_keyword_comments} comments out of {max_comments} ({round(num_keyword_comments / max_comments * 100, 6)}%)")
 
 if __name__ == '__main__':
     year = "2010"
     month = "04"
-    input_filename = f'./RC_{year}-{month}'  # Replace with your input file name
+    input_filename = f'./RC_{year}-{month}.zst'  # Replace with your input file name (.zst or already decompressed)
     output_filename = f'out/reddit_comments_{year}_{month}_keywords.csv'  # Replace with your desired output file name
     export_to_csv(input_filename, output_filename)
-